@@ -22,7 +22,7 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'farhoodapp.authentication.ExpiringTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -40,6 +40,7 @@ AUTHENTICATION_BACKENDS = (
 )
 
 MIDDLEWARE = [
+    'farhoodapp.middleware.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,10 +50,62 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# SQL statistics of a SAMPLE_RATE share of requests, sent as X-DB-Queries/Server-Timing
+# headers when HEADERS is set and logged by 'farhoodapp.middleware' for requests slower
+# than SLOW_REQUEST_MS or running at least SLOW_REQUEST_QUERIES statements. The headers
+# tell any client how the database is doing; in development set SAMPLE_RATE to 1.0 and
+# HEADERS to True.
+SQL_INSTRUMENTATION = {
+    'SAMPLE_RATE': 0.01,
+    'HEADERS': False,
+    'SLOW_REQUEST_MS': 500,
+    'SLOW_REQUEST_QUERIES': 50,
+    'SLOWEST': 3,
+    'DUPLICATES': 5,
+}
+
+# The response cache holds the version tokens that signal handlers bump, in the web workers
+# and in the run_jobs process alike, so it must be shared between processes: files by default,
+# memcached or redis in larger deployments. Local memory only works for a single process
+# with JOB_QUEUE['ALWAYS_EAGER'].
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'farhood',
+    },
+    'responses': {
+        'BACKEND': 'farhoodapp.cache.ResponseFileCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'responses'),
+        'OPTIONS': {'MAX_ENTRIES': 20000, 'CULL_INTERVAL': 100},
+    },
+}
+
+RESPONSE_CACHE = {
+    'ALIAS': 'responses',
+    'TIMEOUT': 300,
+}
+
+PAGINATION = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+}
+
+# Latest comments embedded in the event detail, older ones come from /farhood/event/comments/.
+EVENT_DETAIL_COMMENTS = 10
+
+# Largest radius in km accepted by /farhood/events/nearby/.
+NEARBY_EVENTS_MAX_RADIUS = 100
+
 TIMED_AUTH_TOKEN = {
-    'DEFAULT_VALIDITY_DURATION': timedelta(days=45)
+    'DEFAULT_VALIDITY_DURATION': timedelta(days=45),
+    # Per-process token -> user cache; the timeout (seconds) bounds staleness across workers.
+    'CACHE_TIMEOUT': 60,
+    'CACHE_MAX_ENTRIES': 10000,
 }
 
+# Calling code assumed for contact numbers saved without one.
+PHONE_NUMBER_DEFAULT_COUNTRY_CODE = '1'
+
 ROOT_URLCONF = 'farhood.urls'
 
 TEMPLATES = [
@@ -73,10 +126,14 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'farhood.wsgi.application'
 
+# farhood.sqlite is the sqlite3 backend with WAL journaling, tuned pragmas and BEGIN IMMEDIATE
+# transactions for several workers writing to one file; OPTIONS {'pragmas': {...}} overrides
+# the pragmas. Connections are kept for CONN_MAX_AGE seconds instead of one per request.
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'farhood.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
     }
 }
 
@@ -105,6 +162,53 @@ USE_L10N = True
 
 USE_TZ = True
 
+PROFILE_IMAGE = {
+    'SIZES': (64, 256, 1024),
+    'PROFILE_SIZE': 256,
+    'FORMAT': 'JPEG',
+    'QUALITY': 80,
+}
+
+# Background jobs run by 'manage.py run_jobs'; requests with more than ASYNC_THRESHOLD
+# contacts or invitees are queued instead of handled inline.
+JOB_QUEUE = {
+    'WORKERS': 4,
+    'POLL_INTERVAL': 1.0,
+    'LEASE': 300,
+    'MAX_ATTEMPTS': 3,
+    'RETRY_DELAY': 30,
+    'ASYNC_THRESHOLD': 200,
+    'ALWAYS_EAGER': False,
+}
+
+# Fan-out-on-write feed: events of authors with at most FANOUT_MAX_FOLLOWERS friends are
+# copied into their friends' FeedEntry inboxes by a job, bigger authors are pulled on read.
+# A rebuild copies up to INBOX_SIZE past events, a new friendship BACKFILL events each way.
+FEED = {
+    'FANOUT': False,
+    'FANOUT_MAX_FOLLOWERS': 5000,
+    'INBOX_SIZE': 1000,
+    'BACKFILL': 50,
+}
+
+# Live event streams at /farhood/event/stream/. LocalBroker only reaches subscribers in the
+# same process; multi-process deployments use 'farhoodapp.pubsub.CacheBroker' with
+# OPTIONS {'alias': <shared cache>}. Streams end after STREAM_TIMEOUT seconds and clients
+# reconnect with Last-Event-ID after RETRY seconds.
+PUBSUB = {
+    'BACKEND': 'farhoodapp.pubsub.LocalBroker',
+    'OPTIONS': {'retention': 100},
+    'KEEPALIVE': 15,
+    'STREAM_TIMEOUT': 300,
+    'RETRY': 3,
+}
+
+# /farhood/batch/ limits; WORKERS threads run the reads of parallel batches.
+BATCH = {
+    'MAX_REQUESTS': 20,
+    'WORKERS': 4,
+}
+
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
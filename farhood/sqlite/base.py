@@ -0,0 +1,47 @@
+"""
+SQLite backend tuned for several WSGI workers sharing one database file.
+
+Every new connection switches to WAL journaling, so readers no longer block the writer,
+and applies the PRAGMAS below; OPTIONS['pragmas'] overrides or extends them. Transactions
+start with BEGIN IMMEDIATE (OPTIONS['transaction_mode']), which takes the write lock up
+front and waits on busy_timeout, instead of failing with "database is locked" when a
+read-then-write transaction cannot upgrade its lock.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    # Durable at checkpoints; a power loss can drop the last commits but not corrupt the file.
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    # Negative sizes are KiB: 64 MB of page cache per connection.
+    ('cache_size', -64000),
+    ('mmap_size', 256 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = list(dict(PRAGMAS, **options.get('pragmas', {})).items())
+        self.transaction_mode = options.get('transaction_mode', 'IMMEDIATE').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured('transaction_mode must be one of {}'.format(', '.join(TRANSACTION_MODES)))
+        kwargs = super(DatabaseWrapper, self).get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super(DatabaseWrapper, self).get_new_connection(conn_params)
+        for name, value in self.pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN {}'.format(self.transaction_mode))
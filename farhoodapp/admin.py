@@ -1,8 +1,9 @@
 from django.contrib import admin
-from farhoodapp.models import Event, Comment, Action, EventMember, User
+from farhoodapp.models import Event, Comment, Action, EventMember, User, Job
 
 admin.site.register(User)
 admin.site.register(Event)
 admin.site.register(Comment)
 admin.site.register(Action)
 admin.site.register(EventMember)
+admin.site.register(Job)
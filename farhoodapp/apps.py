@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class FarhoodappConfig(AppConfig):
     name = 'farhoodapp'
+
+    def ready(self):
+        # Connects the response cache, token cache and feed inbox receivers.
+        from farhoodapp import authentication, feed, services  # noqa
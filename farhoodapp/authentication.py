@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from farhoodapp.models import User
+
+USER_FIELDS = [field.attname for field in User._meta.concrete_fields]
+
+
+def token_expired(created):
+    return created + settings.TIMED_AUTH_TOKEN['DEFAULT_VALIDITY_DURATION'] <= timezone.now()
+
+
+class TokenCache(object):
+    """
+    Bounded, thread-safe LRU of token key -> user row, with a TTL per entry.
+
+    Each process keeps its own copy, so the TTL bounds how long another worker may
+    still accept a token after a logout or deactivation handled elsewhere.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        timeout = settings.TIMED_AUTH_TOKEN['CACHE_TIMEOUT']
+        with self.lock:
+            self.entries[key] = (time.time() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TIMED_AUTH_TOKEN['CACHE_MAX_ENTRIES']:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def delete_user(self, user_id):
+        with self.lock:
+            for key in [key for key, (_, value) in self.entries.items() if value[1] == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class ExpiringTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication enforcing TIMED_AUTH_TOKEN['DEFAULT_VALIDITY_DURATION'].
+
+    Valid tokens are served from ``token_cache``, so a cached request authenticates
+    without touching the database. request.user is then a snapshot up to CACHE_TIMEOUT
+    seconds old: views writing the user load the current row and save with update_fields.
+    """
+
+    def authenticate_credentials(self, key):
+        entry = token_cache.get(key)
+        if entry is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            user = token.user
+            entry = (token.created, user.id, user._state.db, [getattr(user, name) for name in USER_FIELDS])
+            if user.is_active and not token_expired(token.created):
+                token_cache.set(key, entry)
+        created, user_id, db, values = entry
+
+        if token_expired(created):
+            token_cache.delete(key)
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        user = User.from_db(db, USER_FIELDS, values)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return user, Token.from_db(db, ['key', 'user_id', 'created'], [key, user_id, created])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_tokens(sender, instance=None, **kwargs):
+    # Also covers deactivation and keeps request.user in step with profile edits.
+    token_cache.delete_user(instance.id)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance=None, **kwargs):
+    token_cache.delete(instance.key)
@@ -0,0 +1,158 @@
+import json
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from rest_framework import status
+
+logger = logging.getLogger(__name__)
+
+# Only the API can be batched, not the admin or the auth views mounted next to it.
+API_PREFIX = '/farhood/'
+READ_METHODS = ('GET', 'HEAD')
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# Environ keys describing the batch call itself: its conditional and body headers are not the sub-requests'.
+OWN_HEADER_PREFIXES = ('wsgi.', 'HTTP_IF_', 'CONTENT_', 'HTTP_CONTENT_')
+
+executor = ThreadPoolExecutor(max_workers=settings.BATCH['WORKERS'])
+
+
+def encode_form(form):
+    """Multipart body for ``form``, the form encoding the API parsers accept."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, values in form.items():
+        for value in values if isinstance(values, list) else [values]:
+            parts.append('--{}\r\nContent-Disposition: form-data; name="{}"\r\n\r\n{}\r\n'.format(
+                boundary, name, value))
+    parts.append('--{}--\r\n'.format(boundary))
+    return ''.join(parts).encode('utf-8'), 'multipart/form-data; boundary={}'.format(boundary)
+
+
+def header_key(name):
+    return 'HTTP_{}'.format(name.upper().replace('-', '_'))
+
+
+def build_request(request, method, path, body=None, form=None, headers=None):
+    """
+    A WSGI request for ``path`` sharing the headers of the batch ``request`` and its
+    authentication, so the sub-request skips the token lookup. Conditional and body
+    headers of the batch call are dropped; ``headers`` adds the sub-request's own,
+    e.g. {'If-None-Match': etag}.
+    """
+    path, _, query = path.partition('?')
+    if form is not None:
+        content, content_type = encode_form(form)
+    else:
+        content, content_type = json.dumps(body).encode('utf-8') if body is not None else b'', 'application/json'
+    environ = {key: value for key, value in request.META.items() if not key.startswith(OWN_HEADER_PREFIXES)}
+    environ.update({header_key(name): value for name, value in (headers or {}).items()})
+    environ.update({
+        'wsgi.input': BytesIO(content),
+        'wsgi.url_scheme': request.scheme,
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(content)),
+    })
+    sub_request = WSGIRequest(environ)
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+    return sub_request
+
+
+def run_request(request, item, excluded):
+    """
+    :param request: the authenticated batch request
+    :param item: dict with ``method``, ``path`` under API_PREFIX, optional ``headers`` and an optional JSON ``body``
+        or multipart ``form``
+    :param excluded: view classes that cannot run inside a batch
+    :return: dict with the sub-request ``status``, parsed ``body`` and its ``etag`` when it has one
+    """
+    method = item['method']
+    path = item['path'].partition('?')[0]
+    if not path.startswith(API_PREFIX):
+        return {'status': status.HTTP_404_NOT_FOUND, 'body': None}
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return {'status': status.HTTP_404_NOT_FOUND, 'body': None}
+    if getattr(match.func, 'view_class', None) in excluded:
+        return {'status': status.HTTP_400_BAD_REQUEST, 'body': 'This path cannot be batched'}
+
+    sub_request = build_request(request, method, item['path'], item.get('body'), item.get('form'),
+                                item.get('headers'))
+    try:
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+    except Exception:
+        logger.exception('Batched %s %s failed', method, item['path'])
+        return {'status': status.HTTP_500_INTERNAL_SERVER_ERROR, 'body': None}
+    if response.streaming:
+        response.close()
+        return {'status': status.HTTP_400_BAD_REQUEST, 'body': 'Streaming responses cannot be batched'}
+    body = response.content.decode(response.charset)
+    if response.get('Content-Type', '').startswith('application/json') and body:
+        body = json.loads(body)
+    result = {'status': response.status_code, 'body': body}
+    if response.has_header('ETag'):
+        result['etag'] = response['ETag']
+    return result
+
+
+def run_in_thread(request, item, excluded):
+    try:
+        return run_request(request, item, excluded)
+    finally:
+        close_old_connections()
+
+
+def run_batch(request, items, parallel=False, excluded=()):
+    """
+    Run sub-requests in order; with ``parallel`` each run of consecutive reads goes to the thread pool.
+
+    :return: one result per item, in the order of ``items``
+    """
+    results, reads = [], []
+
+    def flush():
+        if len(reads) > 1:
+            results.extend(executor.map(lambda item: run_in_thread(request, item, excluded), reads))
+        else:
+            results.extend(run_request(request, item, excluded) for item in reads)
+        del reads[:]
+
+    for item in items:
+        if parallel and item['method'] in READ_METHODS:
+            reads.append(item)
+            continue
+        flush()
+        results.append(run_request(request, item, excluded))
+    flush()
+    return results
+
+
+def validate_batch(items):
+    """:return: an error message, or None when ``items`` is a valid list of sub-requests"""
+    if not isinstance(items, list) or not items:
+        return 'requests must be a non-empty list'
+    if len(items) > settings.BATCH['MAX_REQUESTS']:
+        return 'at most {} requests can be batched'.format(settings.BATCH['MAX_REQUESTS'])
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            return 'every request needs a path'
+        headers = item.get('headers', {})
+        if not isinstance(headers, dict) or not all(isinstance(name, str) and isinstance(value, str)
+                                                    for name, value in headers.items()):
+            return 'headers must be an object of strings'
+        item['method'] = str(item.get('method', 'GET')).upper()
+        if item['method'] not in READ_METHODS + WRITE_METHODS:
+            return 'unsupported method {}'.format(item['method'])
+    return None
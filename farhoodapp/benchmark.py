@@ -0,0 +1,379 @@
+"""
+Synthetic dataset and endpoint benchmark, shared by the budget test in tests.py and
+``manage.py benchmark``.
+
+Every route of farhoodapp/urls.py is driven through the Django test client on cold caches
+(response cache and token cache cleared before each request), so the recorded SQL query
+counts are the worst case and do not depend on the order the routes run in. The response
+cache used is a private copy, never the one of servers running from the same checkout.
+"""
+import datetime
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from farhoodapp.authentication import token_cache
+from farhoodapp.geo import encode_geohash
+from farhoodapp.jobs import enqueue
+from farhoodapp.models import Comment, Event, EventMember, EventReaction, User
+from farhoodapp.phone import normalize_phone_number
+from farhoodapp.services import get_response_cache
+from farhoodapp.utils import chunked, QUERY_BATCH_SIZE
+
+BUDGETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_budgets.json')
+API_PREFIX = '/farhood/'
+PASSWORD = 'benchmark'
+
+DEFAULT_SIZES = {
+    'users': 200,
+    'friends': 20,
+    'events': 3,
+    'members': 5,
+    'comments': 5,
+    'reactions': 5,
+    'contacts': 100,
+}
+
+# Latency budgets are the measured p95 times this factor, so only real regressions fail.
+LATENCY_HEADROOM = 4
+MIN_LATENCY_BUDGET_MS = 50
+
+SAVEPOINT_STATEMENTS = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+class Dataset(object):
+    def __init__(self, user_ids, event_ids, job_id, sizes):
+        self.user_ids = user_ids
+        self.event_ids = event_ids
+        self.job_id = job_id
+        self.sizes = sizes
+        self.user = User.objects.get(id=user_ids[0])
+        self.tokens = dict(Token.objects.filter(user_id__in=user_ids).values_list('user_id', 'key'))
+        through = User.ref_user.through
+        self.friend_ids = list(through.objects.filter(from_user_id=self.user.id).order_by('to_user_id')
+                               .values_list('to_user_id', flat=True))
+        self.own_event_ids = list(Event.objects.filter(user=self.user).order_by('id').values_list('id', flat=True))
+        self.other_event_ids = [event_id for event_id in event_ids if event_id not in set(self.own_event_ids)]
+        joined = set(EventMember.objects.filter(user=self.user).values_list('event_id', flat=True))
+        # Events the user has not joined yet, so every follow and unfollow call inserts a member.
+        self.free_event_ids = [event_id for event_id in self.other_event_ids if event_id not in joined]
+
+    def other_event(self, iteration):
+        return self.other_event_ids[iteration % len(self.other_event_ids)]
+
+
+def seed_dataset(users=200, friends=20, events=3, members=5, comments=5, reactions=5, contacts=100, seed=0):
+    """
+    Bulk insert a reproducible social graph: ``users`` with about ``friends`` friends each,
+    ``events`` events per user, and ``members``, ``comments`` and ``reactions`` per event
+    picked among the owner's friends. The first user is the one the benchmark logs in as.
+
+    :return: Dataset with the ids the routes need
+    """
+    rng = random.Random(seed)
+    password = make_password(PASSWORD)
+    User.objects.bulk_create([
+        User(email='bench{}@example.com'.format(index), username='bench{}'.format(index), password=password,
+             first_name='Bench', last_name='User {}'.format(index), phone_number='+1555{:07d}'.format(index),
+             phone_key=normalize_phone_number('+1555{:07d}'.format(index)), temporary_profile=False)
+        for index in range(users)], batch_size=QUERY_BATCH_SIZE)
+    user_ids = list(User.objects.filter(email__startswith='bench', email__endswith='@example.com')
+                    .order_by('id').values_list('id', flat=True))
+    Token.objects.bulk_create([Token(key=Token().generate_key(), user_id=user_id) for user_id in user_ids],
+                              batch_size=QUERY_BATCH_SIZE)
+
+    pairs = set()
+    for user_id in user_ids:
+        for friend_id in rng.sample(user_ids, min(friends, len(user_ids) - 1) + 1):
+            if friend_id != user_id:
+                pairs.update([(user_id, friend_id), (friend_id, user_id)])
+    through = User.ref_user.through
+    through.objects.bulk_create([through(from_user_id=from_id, to_user_id=to_id) for from_id, to_id in sorted(pairs)],
+                                batch_size=QUERY_BATCH_SIZE)
+    friends_of = {}
+    for from_id, to_id in pairs:
+        friends_of.setdefault(from_id, []).append(to_id)
+
+    now = timezone.now()
+    new_events = []
+    for user_id in user_ids:
+        for index in range(events):
+            latitude, longitude = 40 + rng.uniform(-0.2, 0.2), -74 + rng.uniform(-0.2, 0.2)
+            new_events.append(Event(user_id=user_id, name='Event {}'.format(index), description='Benchmark event',
+                                    location_name='Somewhere', location_address='1 Benchmark Road',
+                                    latitude=latitude, longitude=longitude,
+                                    geohash=encode_geohash(latitude, longitude),
+                                    scheduled_time=now + datetime.timedelta(hours=rng.randint(-240, 240))))
+    Event.objects.bulk_create(new_events, batch_size=QUERY_BATCH_SIZE)
+    event_rows = list(Event.objects.filter(user_id__in=user_ids).order_by('id').values_list('id', 'user_id'))
+
+    new_members, new_comments, new_reactions = [], [], []
+    for event_id, owner_id in event_rows:
+        candidates = sorted(friends_of.get(owner_id, []))
+        for member_id in rng.sample(candidates, min(members, len(candidates))):
+            new_members.append(EventMember(event_id=event_id, user_id=member_id, follow=rng.random() < 0.5))
+        for index in range(comments):
+            new_comments.append(Comment(event_id=event_id, user_id=rng.choice(candidates or [owner_id]),
+                                        message='Comment {}'.format(index)))
+        for reactor_id in rng.sample(candidates, min(reactions, len(candidates))):
+            new_reactions.append(EventReaction(event_id=event_id, user_id=reactor_id, reaction=rng.random() < 0.8))
+    EventMember.objects.bulk_create(new_members, batch_size=QUERY_BATCH_SIZE)
+    Comment.objects.bulk_create(new_comments, batch_size=QUERY_BATCH_SIZE)
+    EventReaction.objects.bulk_create(new_reactions, batch_size=QUERY_BATCH_SIZE)
+    for batch in chunked(user_ids, QUERY_BATCH_SIZE):
+        User.objects.refresh_counters(User.objects.filter(id__in=batch))
+
+    owner = User.objects.get(id=user_ids[0])
+    job = enqueue('import_contacts', user=owner, user_id=owner.id, contacts=[])
+    sizes = dict(users=users, friends=friends, events=events, members=members, comments=comments,
+                 reactions=reactions, contacts=contacts, seed=seed)
+    return Dataset(user_ids, [event_id for event_id, _ in event_rows], job.id, sizes)
+
+
+class Route(object):
+    """
+    One API call. ``payload`` and ``user`` are functions of the iteration, so writes that
+    must differ between calls (new emails, other events) can vary them; ``overrides``
+    are settings applied while the route runs.
+    """
+
+    def __init__(self, pattern, method, path, payload=None, content_type=None, user=None, overrides=None):
+        self.pattern = pattern
+        self.method = method
+        self.path = path
+        self.payload = payload
+        self.content_type = content_type
+        self.user = user
+        self.overrides = overrides or {}
+
+
+def build_routes(data):
+    user = data.user
+    own_event = data.own_event_ids[0]
+    other_event = data.other_event_ids[0]
+    contacts = data.sizes['contacts']
+
+    def event_body(iteration):
+        return {'name': 'Benchmark {}'.format(iteration), 'description': 'Created by the benchmark',
+                'location_name': 'Here', 'location_address': '2 Benchmark Road', 'latitude': 40.1,
+                'longitude': -74.1}
+
+    def contacts_body(iteration):
+        known = ['+1555{:07d}'.format(index) for index in range(1, min(contacts // 2, len(data.user_ids)))]
+        new = ['+1666{:03d}{:04d}'.format(iteration, index) for index in range(contacts - len(known))]
+        return [{'phone_number': number, 'name': 'Contact {}'.format(index)}
+                for index, number in enumerate(known + new)]
+
+    def friend(iteration):
+        return {'user_id': data.friend_ids[iteration % len(data.friend_ids)]}
+
+    json_type = 'application/json'
+    routes = [
+        Route('get_auth_token/', 'post', 'get_auth_token/', lambda i: {'username': user.email, 'password': PASSWORD}),
+        Route('user/create/', 'post', 'user/create/',
+              lambda i: {'email': 'new{}@example.com'.format(i), 'password': 'secret'}),
+        Route('profile/', 'put', 'profile/', lambda i: {'first_name': 'Bench', 'last_name': 'Updated'}, json_type),
+        Route('event/create/', 'post', 'event/create/', event_body, json_type),
+        Route('edit/event/', 'post', 'edit/event/', lambda i: dict(event_body(i), id=own_event), json_type),
+        Route('create/comment/', 'post', 'create/comment/',
+              lambda i: {'event': other_event, 'message': 'Benchmark {}'.format(i)}),
+        Route('create/reaction/', 'post', 'create/reaction/', lambda i: {'event': other_event, 'reaction': i % 2}),
+        Route('create/wishlist/', 'post', 'create/wishlist/', lambda i: {'event': data.other_event(i)}),
+        Route('action/create/', 'post', 'action/create/', lambda i: {'event': other_event, 'action_type': 'good'}),
+        Route('add/member/', 'post', 'add/member/',
+              lambda i: {'event': own_event, 'users': contacts_body(i)[::2]}, json_type),
+        Route('follow/member/', 'post', 'follow/member/', lambda i: {'event': data.free_event_ids[i]}),
+        Route('unfollow/member/', 'post', 'unfollow/member/', lambda i: {'event': data.free_event_ids[-1 - i]}),
+        Route('contacts/', 'post', 'contacts/', contacts_body, json_type),
+        Route('job/', 'get', 'job/?job_id={}'.format(data.job_id)),
+        Route('friend/unfollow/', 'post', 'friend/unfollow/', friend),
+        Route('friend/follow/', 'post', 'friend/follow/', friend),
+        Route('remove/member/', 'post', 'remove/member/', lambda i: {'event': data.other_event(i)}),
+        Route('follow/event/', 'get', 'follow/event/'),
+        Route('unfollow/event/', 'get', 'unfollow/event/'),
+        Route('comment/', 'get', 'comment/?event_id={}'.format(other_event)),
+        Route('action/event/', 'get', 'action/event/?event_id={}'.format(other_event)),
+        Route('user/event/', 'get', 'user/event/'),
+        Route('events/nearby/', 'get', 'events/nearby/?latitude=40&longitude=-74&radius=25'),
+        Route('feed/', 'get', 'feed/'),
+        Route('event/comments/', 'get', 'event/comments/?event_id={}'.format(other_event)),
+        Route('event/stream/', 'get', 'event/stream/?poll=1&event_id={}'.format(other_event),
+              overrides={'PUBSUB': dict(settings.PUBSUB, KEEPALIVE=0)}),
+        Route('batch/', 'post', 'batch/', lambda i: {'requests': [
+            {'method': 'GET', 'path': API_PREFIX + path} for path in ('get/profile/', 'get/friends/', 'user/event/')]},
+            json_type),
+        Route('get/friends/', 'get', 'get/friends/'),
+        Route('get/contacts/', 'get', 'get/contacts/'),
+        Route('get/profile/', 'get', 'get/profile/'),
+        Route('image/', 'get', 'image/'),
+        # Logging out deletes the token, so every call uses another user.
+        Route('logout/', 'get', 'logout/', user=lambda i: data.user_ids[-1 - i]),
+    ]
+    return routes
+
+
+def api_patterns():
+    """Routes of farhoodapp/urls.py as they appear in the benchmark, e.g. 'get/friends/'."""
+    resolver = get_resolver()
+    patterns = set()
+    for prefix in resolver.url_patterns:
+        if getattr(prefix, 'url_patterns', None) is None or prefix.regex.pattern != '^farhood/':
+            continue
+        for pattern in prefix.url_patterns:
+            regex = pattern.regex.pattern.lstrip('^').rstrip('$')
+            if not regex.startswith(settings.STATIC_URL.lstrip('/')) and '(?P' not in regex:
+                patterns.add(regex)
+    return patterns
+
+
+def count_queries(captured):
+    """
+    Statements run, leaving out savepoints: atomic blocks only issue them when nested,
+    e.g. inside the transaction of a TestCase, so counts match the command's.
+    """
+    return sum(1 for query in captured if not query['sql'].startswith(SAVEPOINT_STATEMENTS))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+def response_status(response):
+    """
+    The ``code`` of a CustomResponse envelope, which is sent with HTTP 200 even for errors;
+    the HTTP status of other responses.
+    """
+    if response.streaming or not response.get('Content-Type', '').startswith('application/json'):
+        return response.status_code
+    try:
+        body = json.loads(response.content.decode(response.charset))
+    except ValueError:
+        return response.status_code
+    code = body.get('code') if isinstance(body, dict) else None
+    return code if isinstance(code, int) and not isinstance(code, bool) else response.status_code
+
+
+def call(client, route, iteration, token):
+    kwargs = {'HTTP_AUTHORIZATION': 'Token {}'.format(token)}
+    path = API_PREFIX + route.path
+    if route.payload is None:
+        return getattr(client, route.method)(path, **kwargs)
+    body = route.payload(iteration)
+    if route.content_type:
+        return getattr(client, route.method)(path, json.dumps(body), content_type=route.content_type, **kwargs)
+    return getattr(client, route.method)(path, body, **kwargs)
+
+
+@contextmanager
+def private_response_cache():
+    """Point the response cache alias at a throwaway location, so it can be cleared at will."""
+    alias = settings.RESPONSE_CACHE['ALIAS']
+    location = tempfile.mkdtemp(prefix='farhood-benchmark-')
+    caches = dict(settings.CACHES)
+    caches[alias] = dict(caches[alias], LOCATION=location)
+    try:
+        with override_settings(CACHES=caches):
+            yield
+    finally:
+        shutil.rmtree(location, ignore_errors=True)
+
+
+@private_response_cache()
+def run_benchmark(data, repeat=5, routes=None):
+    """
+    :param data: Dataset from seed_dataset
+    :param repeat: calls per route
+    :param routes: optional route patterns to run, all by default
+    :return: dict of route pattern -> the distinct ``statuses`` answered, SQL ``queries`` and
+        latency percentiles in ms
+    """
+    client = Client()
+    results = {}
+    for route in build_routes(data):
+        if routes and route.pattern not in routes:
+            continue
+        latencies, queries, statuses = [], [], set()
+        with override_settings(**route.overrides):
+            for iteration in range(repeat):
+                user_id = route.user(iteration) if route.user else data.user.id
+                get_response_cache().clear()
+                token_cache.clear()
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = call(client, route, iteration, data.tokens[user_id])
+                    latencies.append((time.perf_counter() - started) * 1000)
+                queries.append(count_queries(context.captured_queries))
+                statuses.add(response_status(response))
+        results[route.pattern] = {
+            'method': route.method.upper(),
+            'statuses': sorted(statuses),
+            'queries': max(queries),
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(max(latencies), 2),
+        }
+    return results
+
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path) as budgets:
+        return json.load(budgets)
+
+
+def make_budgets(results, sizes, repeat):
+    routes = {}
+    for pattern, result in sorted(results.items()):
+        routes[pattern] = {
+            'queries': result['queries'],
+            'p95_ms': max(MIN_LATENCY_BUDGET_MS, int(math.ceil(result['p95_ms'] * LATENCY_HEADROOM))),
+        }
+    return {'dataset': sizes, 'repeat': repeat, 'routes': routes}
+
+
+def check_budgets(results, budgets, latency=True):
+    """
+    :param latency: also check the p95 latencies, which depend on the machine and its load
+    :return: list of messages, one per route that answered anything but 2xx or is over its query
+        or latency budget
+    """
+    failures = []
+    for pattern, result in sorted(results.items()):
+        budget = budgets['routes'].get(pattern)
+        if budget is None:
+            failures.append('{} has no budget'.format(pattern))
+            continue
+        errors = [code for code in result['statuses'] if not 200 <= code < 300]
+        if errors:
+            failures.append('{} answered {}'.format(pattern, ', '.join(str(code) for code in errors)))
+        if result['queries'] > budget['queries']:
+            failures.append('{} ran {} queries, budget {}'.format(pattern, result['queries'], budget['queries']))
+        if latency and result['p95_ms'] > budget['p95_ms']:
+            failures.append('{} p95 {}ms, budget {}ms'.format(pattern, result['p95_ms'], budget['p95_ms']))
+    return failures
+
+
+def format_results(results):
+    lines = ['{:<20} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+        'route', 'status', 'sql', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms')]
+    for pattern, result in sorted(results.items()):
+        lines.append('{:<20} {:>8} {:>6} {:>8} {:>8} {:>8} {:>8}'.format(
+            pattern, ','.join(str(code) for code in result['statuses']), result['queries'], result['p50_ms'],
+            result['p95_ms'], result['p99_ms'], result['max_ms']))
+    return '\n'.join(lines)
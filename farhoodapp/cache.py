@@ -0,0 +1,22 @@
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class ResponseFileCache(FileBasedCache):
+    """
+    File cache shared by the web workers and the job process.
+
+    The stock backend lists the whole directory to cull after every write, so bumping the
+    versions of a few hundred keys took seconds; this one culls every OPTIONS['CULL_INTERVAL']
+    writes of a process, letting the cache overshoot MAX_ENTRIES by at most that many files each.
+    """
+
+    def __init__(self, dir, params):
+        super(ResponseFileCache, self).__init__(dir, params)
+        self._cull_interval = int(params.get('OPTIONS', {}).get('CULL_INTERVAL', 100))
+        self._writes = 0
+
+    def _cull(self):
+        self._writes += 1
+        if self._writes >= self._cull_interval:
+            self._writes = 0
+            super(ResponseFileCache, self)._cull()
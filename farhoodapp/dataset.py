@@ -0,0 +1,241 @@
+"""
+Synthetic data at load-test scale, written by ``manage.py generate_dataset``.
+
+Rows are produced chunk by chunk as plain tuples and written with multi-row INSERTs,
+skipping model instances and signals, so memory stays bounded by the chunk size and
+millions of users load in minutes. Counts follow a power law: most users have a few
+friends and most events a few members, a handful of hubs and hot events get thousands.
+"""
+import datetime
+import hashlib
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from farhoodapp.geo import encode_geohash
+from farhoodapp.models import Action, Comment, Event, EventMember, EventReaction, EventWishList, User
+from farhoodapp.phone import normalize_phone_number
+
+# Pareto shape of every count; below 2 the mean no longer exists, higher flattens the tail.
+POWER_LAW_ALPHA = 2.2
+# Picks among existing users are skewed towards the oldest ids, which become the hubs.
+POPULARITY_SKEW = 2.0
+MAX_ROWS_PER_INSERT = 1000
+
+CITIES = (
+    (40.7128, -74.0060),
+    (34.0522, -118.2437),
+    (51.5074, -0.1278),
+    (48.8566, 2.3522),
+    (31.5204, 74.3587),
+    (24.8607, 67.0011),
+    (25.2048, 55.2708),
+    (35.6762, 139.6503),
+)
+
+
+class RowWriter(object):
+    """
+    Buffered multi-row INSERT into the table of ``model``.
+
+    :param model: model whose table is written
+    :param fields: attnames of the values in each row; other columns get their default,
+        auto_now columns the time the writer was created
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = [model._meta.get_field(name) for name in fields]
+        now = timezone.now()
+        self.defaults = []
+        for field in model._meta.concrete_fields:
+            if field in self.fields or isinstance(field, models.AutoField):
+                continue
+            value = now if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False) \
+                else field.get_default()
+            self.defaults.append((field, field.get_db_prep_save(value, connection)))
+        columns = [field.column for field in self.fields] + [field.column for field, _ in self.defaults]
+        self.default_values = [value for _, value in self.defaults]
+        self.prepared = [isinstance(field, models.DateTimeField) for field in self.fields]
+        self.batch_size = min(MAX_ROWS_PER_INSERT,
+                              connection.ops.bulk_batch_size(columns, [None] * MAX_ROWS_PER_INSERT))
+        self.sql = 'INSERT INTO {} ({}) VALUES '.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(connection.ops.quote_name(column) for column in columns))
+        self.placeholder = '({})'.format(', '.join(['%s'] * len(columns)))
+        self.rows = []
+        self.written = 0
+
+    def write(self, row):
+        values = [self.fields[index].get_db_prep_save(value, connection) if prepare else value
+                  for index, (value, prepare) in enumerate(zip(row, self.prepared))]
+        self.rows.append(values + self.default_values)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.sql + ', '.join([self.placeholder] * len(self.rows)),
+                           [value for row in self.rows for value in row])
+        self.written += len(self.rows)
+        self.rows = []
+
+
+class DatasetGenerator(object):
+    """
+    :param users: number of users to add
+    :param friends: mean number of friendships each user starts
+    :param events: mean number of events per non-temporary user
+    :param members: mean members per event, and likewise ``comments``, ``reactions``,
+        ``actions`` and ``wishlists``
+    :param temporary: share of users that are temporary profiles created by contact imports
+    :param days: events are created over the past ``days`` and scheduled up to ``days`` later
+    :param tokens: the first ``tokens`` new users get an auth token, to log in as during load tests
+    """
+
+    def __init__(self, users, friends=20, events=2, members=5, comments=3, reactions=3, actions=1, wishlists=1,
+                 temporary=0.2, days=90, tokens=100, seed=0, max_count=5000):
+        self.users = users
+        self.means = dict(friends=friends, events=events, members=members, comments=comments,
+                          reactions=reactions, actions=actions, wishlists=wishlists)
+        self.temporary = temporary
+        self.days = days
+        self.tokens = tokens
+        self.max_count = max_count
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.now = timezone.now()
+        self.password = make_password('dataset')
+        self.first_user_id = (User.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        self.next_event_id = (Event.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        self.writers = {
+            'users': RowWriter(User, ['id', 'email', 'username', 'password', 'first_name', 'last_name',
+                                      'phone_number', 'phone_key', 'temporary_profile']),
+            'friendships': RowWriter(User.ref_user.through, ['from_user_id', 'to_user_id']),
+            'events': RowWriter(Event, ['id', 'user_id', 'name', 'event_type', 'description', 'scheduled_time',
+                                        'created_at', 'latitude', 'longitude', 'geohash', 'location_name',
+                                        'location_address']),
+            'members': RowWriter(EventMember, ['event_id', 'user_id', 'follow']),
+            'comments': RowWriter(Comment, ['event_id', 'user_id', 'message', 'created_at']),
+            'reactions': RowWriter(EventReaction, ['event_id', 'user_id', 'reaction']),
+            'actions': RowWriter(Action, ['event_id', 'user_id', 'action_type']),
+            'wishlists': RowWriter(EventWishList, ['event_id', 'user_id']),
+            'tokens': RowWriter(Token, ['key', 'user_id', 'created']),
+        }
+
+    def count(self, name):
+        """Power-law distributed count with the configured mean, capped at ``max_count``."""
+        mean = self.means[name]
+        if mean <= 0:
+            return 0
+        scale = mean * (POWER_LAW_ALPHA - 1) / POWER_LAW_ALPHA
+        return min(self.max_count, int(scale * self.rng.paretovariate(POWER_LAW_ALPHA) + self.rng.random()))
+
+    def pick_user(self, last_id):
+        """A new user id up to ``last_id``, favouring the oldest."""
+        return self.first_user_id + int((last_id - self.first_user_id + 1) * self.rng.random() ** POPULARITY_SKEW)
+
+    def pick_users(self, count, last_id, exclude=None):
+        """
+        Up to ``count`` distinct ids among the new users up to ``last_id``, favouring the oldest;
+        at most half of them, so the rejection loop stays short.
+        """
+        span = last_id - self.first_user_id + 1
+        count = min(count, span // 2)
+        picked = set()
+        while len(picked) < count:
+            user_id = self.pick_user(last_id)
+            if user_id != exclude:
+                picked.add(user_id)
+        return sorted(picked)
+
+    def write_user(self, user_id):
+        phone_number = '+1{}'.format(2000000000 + user_id)
+        temporary = self.rng.random() < self.temporary
+        self.writers['users'].write((user_id, 'user{}@dataset.example.com'.format(user_id), 'user{}'.format(user_id),
+                                     self.password, 'User', str(user_id), phone_number,
+                                     normalize_phone_number(phone_number), temporary))
+        if user_id - self.first_user_id < self.tokens:
+            # Derived from the user id, so later runs with the same seed append users with new keys.
+            key = hashlib.sha1('dataset:{}:{}'.format(self.seed, user_id).encode('utf-8')).hexdigest()
+            self.writers['tokens'].write((key, user_id, self.now))
+        # Friendships only point to older users, so every pair is generated once; ref_user is
+        # symmetrical, so both directions are stored.
+        if user_id > self.first_user_id:
+            for friend_id in self.pick_users(self.count('friends'), user_id - 1):
+                self.writers['friendships'].write((user_id, friend_id))
+                self.writers['friendships'].write((friend_id, user_id))
+        return temporary
+
+    def write_event(self, user_id, last_user_id):
+        event_id = self.next_event_id
+        self.next_event_id += 1
+        rng = self.rng
+        city_latitude, city_longitude = CITIES[int(len(CITIES) * rng.random() ** POPULARITY_SKEW)]
+        latitude, longitude = city_latitude + rng.uniform(-0.3, 0.3), city_longitude + rng.uniform(-0.3, 0.3)
+        created_at = self.now - datetime.timedelta(seconds=rng.randint(0, self.days * 86400))
+        scheduled_time = created_at + datetime.timedelta(seconds=rng.randint(3600, self.days * 86400))
+        self.writers['events'].write((
+            event_id, user_id, 'Event {}'.format(event_id), rng.choice(Event.EVENT_TYPE)[0], 'Generated event',
+            scheduled_time, created_at, latitude, longitude, encode_geohash(latitude, longitude),
+            'Place {}'.format(event_id % 1000), '{} Generated Street'.format(event_id % 10000)))
+
+        for member_id in self.pick_users(self.count('members'), last_user_id, exclude=user_id):
+            self.writers['members'].write((event_id, member_id, rng.random() < 0.6))
+        for index in range(self.count('comments')):
+            commenter_id = self.pick_user(last_user_id)
+            commented_at = created_at + datetime.timedelta(seconds=rng.randint(1, 86400 * 3))
+            self.writers['comments'].write((event_id, commenter_id, 'Comment {}'.format(index), commented_at))
+        for reactor_id in self.pick_users(self.count('reactions'), last_user_id):
+            self.writers['reactions'].write((event_id, reactor_id, rng.random() < 0.85))
+        for actor_id in self.pick_users(self.count('actions'), last_user_id):
+            self.writers['actions'].write((event_id, actor_id, rng.choice(Action.ACTION_TYPE)[0]))
+        for wisher_id in self.pick_users(self.count('wishlists'), last_user_id):
+            self.writers['wishlists'].write((event_id, wisher_id))
+
+    def generate(self, chunk_size=10000, progress=None):
+        """
+        Write the dataset one chunk of users at a time, each chunk in its own transaction.
+
+        :param progress: optional function called with (users written, rows written, seconds) after each chunk
+        :return: dict of table name -> rows written
+        """
+        started = time.time()
+        last_id = self.first_user_id + self.users - 1
+        for start in range(self.first_user_id, last_id + 1, chunk_size):
+            chunk = range(start, min(start + chunk_size, last_id + 1))
+            with transaction.atomic():
+                owners = [user_id for user_id in chunk if not self.write_user(user_id)]
+                for user_id in owners:
+                    for _ in range(self.count('events')):
+                        self.write_event(user_id, chunk[-1])
+                for writer in self.writers.values():
+                    writer.flush()
+            if progress:
+                progress(chunk[-1] - self.first_user_id + 1, self.rows_written(), time.time() - started)
+        self.reset_sequences()
+        return {name: writer.written for name, writer in self.writers.items()}
+
+    def rows_written(self):
+        return sum(writer.written for writer in self.writers.values())
+
+    def reset_sequences(self):
+        # Users and events were inserted with explicit ids; backends with sequences must skip past them.
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Event]):
+                cursor.execute(sql)
+
+    def reconcile_counters(self, chunk_size=10000):
+        """Fill events, participants and friends counters of the new users from the written rows."""
+        last_id = self.first_user_id + self.users - 1
+        updated = 0
+        for start in range(self.first_user_id, last_id + 1, chunk_size):
+            updated += User.objects.refresh_counters(User.objects.filter(id__gte=start, id__lt=start + chunk_size))
+        return updated
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from farhoodapp.models import Event, FeedEntry, User
+from farhoodapp.services import bump_versions
+from farhoodapp.utils import chunked, QUERY_BATCH_SIZE
+
+
+def pushes(user):
+    """Whether events of ``user`` are fanned out to inboxes on write rather than pulled on read."""
+    return settings.FEED['FANOUT'] and user.friends_count <= settings.FEED['FANOUT_MAX_FOLLOWERS']
+
+
+def invalidate_feeds(owner_ids):
+    bump_versions([('friends', owner_id) for owner_id in owner_ids])
+
+
+def fanout_event(event_id):
+    """
+    Copy an event into the inbox of every friend of its author; safe to run again after an edit.
+
+    :return: number of entries created
+    """
+    event = Event.objects.filter(id=event_id).select_related('user').first()
+    if event is None or not pushes(event.user):
+        return 0
+    through = User.ref_user.through
+    owner_ids = set(through.objects.filter(to_user_id=event.user_id).values_list('from_user_id', flat=True))
+    owner_ids -= set(FeedEntry.objects.filter(event_id=event.id).values_list('owner_id', flat=True))
+    FeedEntry.objects.bulk_create([FeedEntry(owner_id=owner_id, event_id=event.id, author_id=event.user_id,
+                                             created_at=event.created_at) for owner_id in owner_ids],
+                                  batch_size=QUERY_BATCH_SIZE)
+    invalidate_feeds(owner_ids)
+    return len(owner_ids)
+
+
+def copy_events(owner_id, author_ids, limit):
+    """
+    Backfill the latest ``limit`` events of the pushing ``author_ids`` into the inbox of ``owner_id``.
+
+    :param author_ids: list or ``values()`` queryset of user ids
+    :return: number of entries created
+    """
+    events = (Event.objects.filter(user_id__in=author_ids,
+                                   user__friends_count__lte=settings.FEED['FANOUT_MAX_FOLLOWERS'])
+              .exclude(id__in=FeedEntry.objects.filter(owner_id=owner_id).values('event_id'))
+              .order_by('-created_at', '-id').values_list('id', 'user_id', 'created_at')[:limit])
+    entries = [FeedEntry(owner_id=owner_id, event_id=event_id, author_id=author_id, created_at=created_at)
+               for event_id, author_id, created_at in events]
+    FeedEntry.objects.bulk_create(entries, batch_size=QUERY_BATCH_SIZE)
+    return len(entries)
+
+
+def link_feeds(user_id, friend_ids):
+    """Exchange recent events between the inboxes of ``user_id`` and its new friends."""
+    if not settings.FEED['FANOUT'] or not friend_ids:
+        return
+    limit = settings.FEED['BACKFILL']
+    friend_ids = list(friend_ids)
+    with transaction.atomic():
+        copy_events(user_id, friend_ids, limit)
+        user = User.objects.get(id=user_id)
+        if pushes(user):
+            events = list(Event.objects.filter(user_id=user_id).order_by('-created_at', '-id')
+                          .values_list('id', 'created_at')[:limit])
+            for batch in chunked(friend_ids, QUERY_BATCH_SIZE):
+                existing = set(FeedEntry.objects.filter(owner_id__in=batch, author_id=user_id)
+                               .values_list('owner_id', 'event_id'))
+                FeedEntry.objects.bulk_create([FeedEntry(owner_id=owner_id, event_id=event_id, author_id=user_id,
+                                                         created_at=created_at)
+                                               for owner_id in batch for event_id, created_at in events
+                                               if (owner_id, event_id) not in existing],
+                                              batch_size=QUERY_BATCH_SIZE)
+    invalidate_feeds([user_id] + friend_ids)
+
+
+def rebuild_feed(owner_id):
+    """
+    Refill the inbox of ``owner_id`` from scratch with the latest INBOX_SIZE events of its friends.
+
+    :return: number of entries created
+    """
+    friend_ids = User.ref_user.through.objects.filter(from_user_id=owner_id).values('to_user_id')
+    with transaction.atomic():
+        FeedEntry.objects.filter(owner_id=owner_id).delete()
+        created = copy_events(owner_id, friend_ids, settings.FEED['INBOX_SIZE'])
+    invalidate_feeds([owner_id])
+    return created
+
+
+@receiver(m2m_changed, sender=User.ref_user.through)
+def sync_feed_entries(sender, instance=None, action=None, pk_set=None, **kwargs):
+    # ref_user is symmetrical, so both inboxes gain or lose the other's events.
+    if action in ('post_remove', 'post_clear'):
+        friend_ids = set(pk_set or getattr(instance, '_cleared_friend_ids', ()))
+        FeedEntry.objects.filter(Q(owner_id=instance.pk, author_id__in=friend_ids) |
+                                 Q(owner_id__in=friend_ids, author_id=instance.pk)).delete()
+        invalidate_feeds(friend_ids | {instance.pk})
+    elif action == 'post_add':
+        link_feeds(instance.pk, pk_set)
@@ -0,0 +1,108 @@
+import math
+
+from django.db import transaction
+from django.db.models import Case, CharField, Value, When
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = 111.32
+BACKFILL_CHUNK_SIZE = 300
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, bit_count, even = [], 0, 0, True
+    while len(geohash) < precision:
+        interval, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def cell_size(precision):
+    """Height and width in degrees of a geohash cell of the given precision."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def bounding_box(latitude, longitude, radius):
+    """Half height and half width in degrees of the box around a circle of ``radius`` km."""
+    delta_lat = radius / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    delta_lon = delta_lat / cos_lat if cos_lat > delta_lat / 180.0 else 180.0
+    return delta_lat, min(delta_lon, 180.0)
+
+
+def covering_cells(latitude, longitude, radius):
+    """
+    Geohash prefixes whose cells together cover the circle of ``radius`` km around the point.
+
+    The coarsest precision whose cells are at least as large as the box is used, so the
+    cell holding the point and its eight neighbours always contain the whole circle.
+    """
+    delta_lat, delta_lon = bounding_box(latitude, longitude, radius)
+    precision = 1
+    while precision < GEOHASH_PRECISION:
+        height, width = cell_size(precision + 1)
+        if height < delta_lat or width < delta_lon:
+            break
+        precision += 1
+    height, width = cell_size(precision)
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        for lon_step in (-1, 0, 1):
+            lat = min(max(latitude + lat_step * height, -90.0), 89.999999)
+            lon = (longitude + lon_step * width + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """Great-circle distance in km."""
+    lat1, lat2 = math.radians(latitude1), math.radians(latitude2)
+    d_lat = lat2 - lat1
+    d_lon = math.radians(longitude2 - longitude1)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def backfill_geohashes(event_model, chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Recompute ``geohash`` for every event in primary key order, one UPDATE per chunk.
+
+    :param event_model: Event model, the historical one when called from a migration
+    :param chunk_size: number of events read and written per statement
+    :return: number of events whose geohash changed
+    """
+    last_id, updated = 0, 0
+    while True:
+        rows = list(event_model.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'latitude', 'longitude', 'geohash')[:chunk_size])
+        if not rows:
+            return updated
+        last_id = rows[-1][0]
+        changes = {}
+        for event_id, latitude, longitude, geohash in rows:
+            computed = None
+            if latitude is not None and longitude is not None:
+                computed = encode_geohash(latitude, longitude)
+            if computed != geohash:
+                changes[event_id] = computed
+        if changes:
+            whens = [When(id=event_id, then=Value(geohash)) for event_id, geohash in changes.items()]
+            with transaction.atomic():
+                event_model.objects.filter(id__in=list(changes)).update(
+                    geohash=Case(*whens, output_field=CharField()))
+            updated += len(changes)
@@ -0,0 +1,57 @@
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from farhoodapp.models import User
+
+
+def thumbnail_name(user_id, size):
+    extension = settings.PROFILE_IMAGE['FORMAT'].lower().replace('jpeg', 'jpg')
+    return '{}/{}/profile_image_{}.{}'.format("Users", user_id, size, extension)
+
+
+def thumbnail_url(user, size, request=None):
+    """
+    URL of the ``size`` px thumbnail, or of the original image until thumbnails are ready.
+    """
+    if user.thumbnails_ready:
+        url = default_storage.url(thumbnail_name(user.id, size))
+    elif user.image:
+        url = user.image.url
+    else:
+        return None
+    return request.build_absolute_uri(url) if request is not None else url
+
+
+def render_thumbnail(image, size):
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    # Nothing from the original info (EXIF, GPS, ICC) is passed on to save().
+    thumbnail.save(buffer, format=settings.PROFILE_IMAGE['FORMAT'], quality=settings.PROFILE_IMAGE['QUALITY'],
+                   optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def process_profile_image(user_id):
+    """
+    Write the configured thumbnail sizes of a user's profile image and mark them ready.
+    """
+    user = User.objects.filter(id=user_id).first()
+    if user is None or not user.image:
+        return
+    with user.image.storage.open(user.image.name, 'rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGB')
+    for size in settings.PROFILE_IMAGE['SIZES']:
+        name = thumbnail_name(user_id, size)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        default_storage.save(name, ContentFile(render_thumbnail(image, size)))
+    user.thumbnails_ready = True
+    user.save(update_fields=['thumbnails_ready'])
+
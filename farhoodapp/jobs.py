@@ -0,0 +1,143 @@
+import json
+import logging
+import socket
+import threading
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from farhoodapp.feed import fanout_event
+from farhoodapp.images import process_profile_image
+from farhoodapp.models import Event, Job, User
+from farhoodapp.utils import import_contacts, invite_event_members
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def task(name):
+    """Register a function as the handler of jobs called ``name``; its payload is passed as kwargs."""
+    def decorator(func):
+        registry[name] = func
+        return func
+    return decorator
+
+
+def enqueue(name, user=None, **payload):
+    """
+    Store a job for the workers started by ``manage.py run_jobs``.
+
+    :param name: registered task name
+    :param user: owner allowed to poll the job status
+    :return: the queued Job, already finished when JOB_QUEUE['ALWAYS_EAGER'] is set
+    """
+    job = Job.objects.create(name=name, user=user, payload=json.dumps(payload))
+    if settings.JOB_QUEUE['ALWAYS_EAGER']:
+        job = claim_job('eager', job_id=job.id)
+        run_job(job)
+        job.refresh_from_db()
+    return job
+
+
+def claimable(now):
+    return Q(status=Job.QUEUED, run_after__lte=now) | Q(status=Job.RUNNING, leased_until__lt=now)
+
+
+def claim_job(worker, job_id=None):
+    """
+    Lease the next due job, or a job whose lease ran out, to ``worker``.
+
+    The claim is a conditional UPDATE, so when several workers race for a row
+    exactly one of them sees it updated.
+    """
+    now = timezone.now()
+    if job_id is None:
+        candidates = Job.objects.filter(claimable(now)).order_by('run_after', 'id').values_list('id', flat=True)[:10]
+    else:
+        candidates = [job_id]
+    for candidate in candidates:
+        claimed = Job.objects.filter(claimable(now), id=candidate).update(
+            status=Job.RUNNING, worker=worker, attempts=F('attempts') + 1, updated_at=now,
+            leased_until=now + timedelta(seconds=settings.JOB_QUEUE['LEASE']))
+        if claimed:
+            return Job.objects.get(id=candidate)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its result, scheduling a retry on failure."""
+    owned = Job.objects.filter(id=job.id, worker=job.worker, status=Job.RUNNING)
+    try:
+        handler = registry[job.name]
+        result = handler(**json.loads(job.payload))
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.id, job.name)
+        if job.attempts < settings.JOB_QUEUE['MAX_ATTEMPTS'] and job.name in registry:
+            owned.update(status=Job.QUEUED, error=traceback.format_exc(), leased_until=None, updated_at=timezone.now(),
+                         run_after=timezone.now() + timedelta(seconds=settings.JOB_QUEUE['RETRY_DELAY']))
+        else:
+            owned.update(status=Job.FAILED, error=traceback.format_exc(), leased_until=None, updated_at=timezone.now())
+        return False
+    owned.update(status=Job.DONE, result=json.dumps(result, default=str), error=None, leased_until=None,
+                 updated_at=timezone.now())
+    return True
+
+
+def worker_name():
+    return '{}:{}'.format(socket.gethostname(), uuid.uuid4().hex[:8])
+
+
+def work(stop, poll_interval, burst=False):
+    """Claim and run jobs until ``stop`` is set, or until the queue is empty in ``burst`` mode."""
+    name = worker_name()
+    while not stop.is_set():
+        close_old_connections()
+        job = claim_job(name)
+        if job is None:
+            if burst:
+                break
+            stop.wait(poll_interval)
+            continue
+        run_job(job)
+    close_old_connections()
+
+
+def run_workers(threads, poll_interval, burst=False, stop=None):
+    stop = stop or threading.Event()
+    workers = [threading.Thread(target=work, args=(stop, poll_interval, burst), daemon=True) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(0.5)
+    except KeyboardInterrupt:
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+@task('import_contacts')
+def import_contacts_task(user_id, contacts):
+    return import_contacts(User.objects.get(id=user_id), contacts)
+
+
+@task('invite_event_members')
+def invite_event_members_task(event_id, users):
+    return invite_event_members(Event.objects.get(id=event_id), users)
+
+
+@task('process_profile_image')
+def process_profile_image_task(user_id):
+    process_profile_image(user_id)
+
+
+@task('fanout_event')
+def fanout_event_task(event_id):
+    return fanout_event(event_id)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from farhoodapp.models import User
+from farhoodapp.phone import BACKFILL_CHUNK_SIZE, backfill_phone_keys
+
+
+class Command(BaseCommand):
+    help = 'Recompute the normalized phone_key of every user, e.g. after changing the default country code.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        updated = backfill_phone_keys(User, chunk_size=options['chunk_size'])
+        self.stdout.write('Updated {} phone keys.'.format(updated))
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from farhoodapp.benchmark import (BUDGETS_PATH, DEFAULT_SIZES, check_budgets, format_results, load_budgets,
+                                  make_budgets, private_response_cache, run_benchmark, seed_dataset)
+
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic dataset in a throwaway test database and report SQL queries and latency "
+            "percentiles for every API route.")
+
+    def add_arguments(self, parser):
+        for name, default in sorted(DEFAULT_SIZES.items()):
+            parser.add_argument('--{}'.format(name), type=int, default=None,
+                                help='Dataset size, {} by default or the size the budgets were recorded with.'.format(
+                                    default))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=None, help='Calls per route.')
+        parser.add_argument('--route', action='append', dest='routes', help='Only run this route, may be repeated.')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file.')
+        parser.add_argument('--check', action='store_true', help='Fail when a route is over its budget.')
+        parser.add_argument('--update-budgets', action='store_true',
+                            help='Record the results as the new budgets in {}.'.format(BUDGETS_PATH))
+
+    def handle(self, *args, **options):
+        budgets = load_budgets() if options['check'] else None
+        sizes = dict(budgets['dataset']) if budgets else dict(DEFAULT_SIZES, seed=0)
+        for name in list(DEFAULT_SIZES) + ['seed']:
+            if options[name] is not None:
+                sizes[name] = options[name]
+        repeat = options['repeat'] or (budgets['repeat'] if budgets else 5)
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with private_response_cache():
+                data = seed_dataset(**sizes)
+            results = run_benchmark(data, repeat=repeat, routes=options['routes'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(format_results(results))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump({'dataset': sizes, 'repeat': repeat, 'results': results}, output, indent=2, sort_keys=True)
+        if options['update_budgets']:
+            with open(BUDGETS_PATH, 'w') as output:
+                json.dump(make_budgets(results, sizes, repeat), output, indent=2, sort_keys=True)
+                output.write('\n')
+            self.stdout.write('Budgets written to {}.'.format(BUDGETS_PATH))
+        if budgets:
+            failures = check_budgets(results, budgets)
+            if failures:
+                raise CommandError('Over budget:\n{}'.format('\n'.join(failures)))
+            self.stdout.write('All routes within budget.')
@@ -0,0 +1,97 @@
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction, OperationalError
+
+from farhoodapp.benchmark import percentile
+
+ENGINES = (
+    ('plain', 'django.db.backends.sqlite3'),
+    ('tuned', 'farhood.sqlite'),
+)
+
+SCHEMA = (
+    'CREATE TABLE bench_event (id integer PRIMARY KEY, comments integer NOT NULL)',
+    'CREATE TABLE bench_comment (id integer PRIMARY KEY AUTOINCREMENT, event_id integer NOT NULL, '
+    'user_id integer NOT NULL, message text NOT NULL, created_at real NOT NULL)',
+    'CREATE INDEX bench_comment_event ON bench_comment (event_id)',
+)
+EVENTS = 100
+
+
+def write_loop(alias, worker, seconds):
+    """
+    Comment writes as CreateCommentView does them: read the event, insert the comment and
+    bump the counter in one transaction, for ``seconds``.
+
+    :return: (committed, locked errors, transaction latencies in ms)
+    """
+    connection = connections[alias]
+    committed, locked, latencies = 0, 0, []
+    deadline = time.time() + seconds
+    step = 0
+    while time.time() < deadline:
+        event_id = (worker * 7 + step) % EVENTS + 1
+        step += 1
+        started = time.perf_counter()
+        try:
+            with transaction.atomic(using=alias):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT comments FROM bench_event WHERE id = %s', [event_id])
+                    cursor.fetchone()
+                    cursor.execute('INSERT INTO bench_comment (event_id, user_id, message, created_at) '
+                                   'VALUES (%s, %s, %s, %s)',
+                                   [event_id, worker, 'Comment {}'.format(step), time.time()])
+                    cursor.execute('UPDATE bench_event SET comments = comments + 1 WHERE id = %s', [event_id])
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+            continue
+        committed += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+    connection.close()
+    return committed, locked, latencies
+
+
+class Command(BaseCommand):
+    help = ('Concurrent comment writes from several processes against a scratch database, with the plain '
+            'sqlite3 backend and with farhood.sqlite (WAL, tuned pragmas, BEGIN IMMEDIATE).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Writer processes, like WSGI workers.')
+        parser.add_argument('--seconds', type=float, default=5)
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp(prefix='farhood-sqlite-')
+        try:
+            for alias, engine in ENGINES:
+                path = os.path.join(directory, '{}.sqlite3'.format(alias))
+                with sqlite3.connect(path) as db:
+                    for sql in SCHEMA:
+                        db.execute(sql)
+                    db.executemany('INSERT INTO bench_event (id, comments) VALUES (?, 0)',
+                                   [(event_id,) for event_id in range(1, EVENTS + 1)])
+                db.close()
+                connections.databases[alias] = {'ENGINE': engine, 'NAME': path}
+                # Forked workers open their own connections.
+                connections[alias].close()
+                with multiprocessing.Pool(options['workers']) as pool:
+                    results = pool.starmap(write_loop, [(alias, worker, options['seconds'])
+                                                       for worker in range(options['workers'])])
+                self.report(alias, engine, results, options['seconds'])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def report(self, alias, engine, results, seconds):
+        committed = sum(result[0] for result in results)
+        locked = sum(result[1] for result in results)
+        latencies = [latency for result in results for latency in result[2]]
+        self.stdout.write('{:<6} {:<28} {:>8.0f} commits/s {:>7} locked  p50 {:>7.2f}ms  p95 {:>7.2f}ms'.format(
+            alias, engine, committed / seconds, locked,
+            percentile(latencies, 0.5) if latencies else 0, percentile(latencies, 0.95) if latencies else 0))
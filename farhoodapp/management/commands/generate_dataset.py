@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from farhoodapp.dataset import DatasetGenerator
+
+
+class Command(BaseCommand):
+    help = ('Add synthetic users, friendships, events, members, comments, reactions, actions and wish lists '
+            'with power-law counts, for load tests. Writes multi-row INSERTs chunk by chunk.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--friends', type=float, default=20, help='Mean friendships started per user.')
+        parser.add_argument('--events', type=float, default=2, help='Mean events per user.')
+        parser.add_argument('--members', type=float, default=5, help='Mean members per event.')
+        parser.add_argument('--comments', type=float, default=3, help='Mean comments per event.')
+        parser.add_argument('--reactions', type=float, default=3, help='Mean reactions per event.')
+        parser.add_argument('--actions', type=float, default=1, help='Mean actions per event.')
+        parser.add_argument('--wishlists', type=float, default=1, help='Mean wish list entries per event.')
+        parser.add_argument('--max-count', type=int, default=5000, help='Cap of any single power-law count.')
+        parser.add_argument('--temporary', type=float, default=0.2, help='Share of temporary profiles.')
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--tokens', type=int, default=100, help='New users that get an auth token.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Users written per transaction.')
+        parser.add_argument('--skip-counters', action='store_true',
+                            help='Leave the profile counters to a later reconcile_user_counters.')
+
+    def handle(self, *args, **options):
+        generator = DatasetGenerator(
+            options['users'], friends=options['friends'], events=options['events'], members=options['members'],
+            comments=options['comments'], reactions=options['reactions'], actions=options['actions'],
+            wishlists=options['wishlists'], temporary=options['temporary'], days=options['days'],
+            tokens=options['tokens'], seed=options['seed'], max_count=options['max_count'])
+
+        def progress(users, rows, seconds):
+            self.stdout.write('{}/{} users, {} rows, {:.0f} rows/s'.format(
+                users, options['users'], rows, rows / max(seconds, 1e-6)))
+
+        started = time.time()
+        written = generator.generate(chunk_size=options['chunk_size'], progress=progress)
+        seconds = time.time() - started
+        for name, rows in sorted(written.items()):
+            self.stdout.write('{:<12} {:>12} rows'.format(name, rows))
+        total = sum(written.values())
+        self.stdout.write('Wrote {} rows in {:.1f}s, {:.0f} rows/s.'.format(total, seconds, total / max(seconds, 1e-6)))
+        if not options['skip_counters']:
+            started = time.time()
+            updated = generator.reconcile_counters(chunk_size=options['chunk_size'])
+            self.stdout.write('Reconciled counters of {} users in {:.1f}s.'.format(updated, time.time() - started))
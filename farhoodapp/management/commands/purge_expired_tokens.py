@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+
+class Command(BaseCommand):
+    help = 'Delete auth tokens older than TIMED_AUTH_TOKEN["DEFAULT_VALIDITY_DURATION"], in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - settings.TIMED_AUTH_TOKEN['DEFAULT_VALIDITY_DURATION']
+        deleted = 0
+        while True:
+            keys = list(Token.objects.filter(created__lte=cutoff).values_list('key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += Token.objects.filter(key__in=keys).delete()[0]
+        self.stdout.write('Deleted {} expired tokens.'.format(deleted))
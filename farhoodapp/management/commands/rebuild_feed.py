@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from farhoodapp.feed import rebuild_feed
+from farhoodapp.models import User
+
+
+class Command(BaseCommand):
+    help = "Refill the FeedEntry inboxes from the friends' latest events, e.g. after enabling FEED['FANOUT']."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Rebuild only this user id, may be repeated.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        owners = User.objects.order_by('id')
+        if options['users']:
+            owners = owners.filter(id__in=options['users'])
+        last_id, rebuilt, created = 0, 0, 0
+        while True:
+            owner_ids = list(owners.filter(id__gt=last_id).values_list('id', flat=True)[:options['chunk_size']])
+            if not owner_ids:
+                break
+            for owner_id in owner_ids:
+                created += rebuild_feed(owner_id)
+            rebuilt += len(owner_ids)
+            last_id = owner_ids[-1]
+        self.stdout.write('Rebuilt {} feeds with {} entries.'.format(rebuilt, created))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from farhoodapp.models import User
+
+
+class Command(BaseCommand):
+    help = 'Recompute events, participants and friends counters of every user from the source tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_id, updated = 0, 0
+        max_id = User.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        while last_id < max_id:
+            users = User.objects.filter(id__gt=last_id, id__lte=last_id + chunk_size)
+            updated += User.objects.refresh_counters(users)
+            last_id += chunk_size
+        self.stdout.write('Reconciled counters of {} users.'.format(updated))
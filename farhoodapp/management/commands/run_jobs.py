@@ -0,0 +1,37 @@
+import multiprocessing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from farhoodapp.jobs import run_workers
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs from the jobs table with a pool of worker threads and, optionally, processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=settings.JOB_QUEUE['WORKERS'])
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--poll-interval', type=float, default=settings.JOB_QUEUE['POLL_INTERVAL'])
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+
+    def handle(self, *args, **options):
+        work_args = (options['threads'], options['poll_interval'], options['burst'])
+        if options['processes'] <= 1:
+            run_workers(*work_args)
+            return
+        # Children must open their own database connections.
+        connections.close_all()
+        stop = multiprocessing.Event()
+        processes = [multiprocessing.Process(target=run_workers, args=work_args + (stop,))
+                     for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for process in processes:
+                process.join()
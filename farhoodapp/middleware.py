@@ -0,0 +1,115 @@
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def fingerprint(sql):
+    """``sql`` with its literals replaced by '?', so the statements of an N+1 loop compare equal."""
+    sql = NUMBER_LITERAL.sub('?', STRING_LITERAL.sub('?', sql))
+    return VALUE_LIST.sub('(?)', sql)
+
+
+class TimedCursorWrapper(CursorDebugWrapper):
+    """
+    The debug cursor, also keeping the duration of each statement at full precision;
+    ``connection.queries`` rounds them to the millisecond.
+    """
+
+    def __init__(self, cursor, db, durations):
+        super(TimedCursorWrapper, self).__init__(cursor, db)
+        self.durations = durations
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursorWrapper, self).execute(sql, params)
+        finally:
+            self.durations.append((time.perf_counter() - started) * 1000)
+
+    def executemany(self, sql, param_list):
+        started = time.perf_counter()
+        try:
+            return super(TimedCursorWrapper, self).executemany(sql, param_list)
+        finally:
+            self.durations.append((time.perf_counter() - started) * 1000)
+
+
+def query_stats(timed):
+    """
+    :param timed: (milliseconds, sql) of each statement
+    :return: dict with the query count, total DB time, slowest statements and repeated fingerprints,
+        all SQL as fingerprints so that no parameter (phone numbers, tokens) reaches the logs
+    """
+    options = settings.SQL_INSTRUMENTATION
+    slowest = sorted(timed, key=lambda item: item[0], reverse=True)[:options['SLOWEST']]
+    repeated = Counter(fingerprint(sql) for _, sql in timed).most_common(options['DUPLICATES'])
+    return {
+        'queries': len(timed),
+        'db_ms': round(sum(duration for duration, _ in timed), 2),
+        'slowest': [{'ms': round(duration, 2), 'fingerprint': fingerprint(sql)[:500]} for duration, sql in slowest],
+        'duplicates': [{'count': count, 'fingerprint': sql[:500]} for sql, count in repeated if count > 1],
+    }
+
+
+class QueryInstrumentationMiddleware(object):
+    """
+    SQL statistics of a sampled share of requests: ``X-DB-Queries`` and ``Server-Timing``
+    headers on the response, and a JSON log line for requests over the slow thresholds
+    of settings.SQL_INSTRUMENTATION.
+
+    Sampled requests run with the debug cursor, which logs and times every statement; the
+    others pay nothing but a random() call. Streamed bodies are produced after the response
+    leaves the middleware, so their queries are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.SQL_INSTRUMENTATION
+        if random.random() >= options['SAMPLE_RATE']:
+            return self.get_response(request)
+
+        tracked = []
+        for connection in connections.all():
+            durations = []
+            tracked.append((connection, connection.force_debug_cursor, len(connection.queries_log), durations))
+            connection.force_debug_cursor = True
+            connection.make_debug_cursor = (
+                lambda cursor, connection=connection, durations=durations:
+                TimedCursorWrapper(cursor, connection, durations))
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            timed = []
+            for connection, force_debug_cursor, start, durations in tracked:
+                connection.force_debug_cursor = force_debug_cursor
+                del connection.make_debug_cursor
+                queries = list(connection.queries_log)[start:]
+                timed.extend(zip(durations, [query['sql'] for query in queries[-len(durations):]]))
+
+        stats = query_stats(timed)
+        if options['HEADERS']:
+            response['X-DB-Queries'] = str(stats['queries'])
+            response['Server-Timing'] = 'db;desc="{} queries";dur={:.2f}, total;dur={:.2f}'.format(
+                stats['queries'], stats['db_ms'], duration)
+        if duration >= options['SLOW_REQUEST_MS'] or stats['queries'] >= options['SLOW_REQUEST_QUERIES']:
+            record = dict(stats, method=request.method, path=request.get_full_path(),
+                          status=response.status_code, duration_ms=round(duration, 2))
+            logger.warning('slow request %s', json.dumps(record, sort_keys=True), extra={'request_stats': record})
+        return response
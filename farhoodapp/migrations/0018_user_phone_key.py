@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from farhoodapp.phone import backfill_phone_keys
+
+
+def forwards(apps, schema_editor):
+    backfill_phone_keys(apps.get_model('farhoodapp', 'User'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farhoodapp', '0017_auto_20180327_1952'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16, null=True),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from farhoodapp.geo import backfill_geohashes
+
+
+def forwards(apps, schema_editor):
+    backfill_geohashes(apps.get_model('farhoodapp', 'Event'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farhoodapp', '0018_user_phone_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
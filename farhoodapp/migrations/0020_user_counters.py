@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def forwards(apps, schema_editor):
+    User = apps.get_model('farhoodapp', 'User')
+    Event = apps.get_model('farhoodapp', 'Event')
+    EventMember = apps.get_model('farhoodapp', 'EventMember')
+
+    def count(queryset, owner):
+        totals = queryset.filter(**{owner: OuterRef('pk')}).order_by().values(owner).annotate(total=Count('id'))
+        return Coalesce(Subquery(totals.values('total'), output_field=IntegerField()), 0)
+
+    User.objects.update(events_count=count(Event.objects.all(), 'user_id'),
+                        participants_count=count(EventMember.objects.all(), 'event__user_id'),
+                        friends_count=count(User.ref_user.through.objects.all(), 'from_user_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farhoodapp', '0019_event_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='events_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='friends_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='participants_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
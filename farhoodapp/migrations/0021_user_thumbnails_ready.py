@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farhoodapp', '0020_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='thumbnails_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:35
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicates(apps, schema_editor):
+    # The most recent row of each (event, user) pair wins.
+    for name in ('EventMember', 'EventReaction'):
+        model = apps.get_model('farhoodapp', name)
+        duplicates = (model.objects.order_by().values('event_id', 'user_id')
+                      .annotate(keep=Max('id'), total=Count('id')).filter(total__gt=1))
+        for row in duplicates:
+            model.objects.filter(event_id=row['event_id'], user_id=row['user_id']).exclude(id=row['keep']).delete()
+
+    User = apps.get_model('farhoodapp', 'User')
+    EventMember = apps.get_model('farhoodapp', 'EventMember')
+    totals = (EventMember.objects.filter(event__user_id=OuterRef('pk')).order_by().values('event__user_id')
+              .annotate(total=Count('id')))
+    User.objects.update(participants_count=Coalesce(Subquery(totals.values('total'), output_field=IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farhoodapp', '0022_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='eventmember',
+            unique_together=set([('event', 'user')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='eventreaction',
+            unique_together=set([('event', 'user')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:36
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farhoodapp', '0023_unique_event_user'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='event',
+            index_together=set([('user', 'scheduled_time'), ('user', 'created_at')]),
+        ),
+    ]
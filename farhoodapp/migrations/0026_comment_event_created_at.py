@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6 on 2026-10-18 16:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farhoodapp', '0025_feedentry'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='comment',
+            index_together=set([('event', 'created_at')]),
+        ),
+    ]
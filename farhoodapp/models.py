@@ -1,10 +1,16 @@
 from django.conf import settings
 from django.contrib.auth.base_user import BaseUserManager, AbstractBaseUser
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework.authtoken.models import Token
 
+from farhoodapp.geo import encode_geohash
+from farhoodapp.phone import normalize_phone_number
+
 
 class UserManager(BaseUserManager):
     def _create_user(self, email, password, **extra_fields):
@@ -33,14 +39,30 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault('is_active', True)
         return self._create_user(email, password, **extra_fields)
 
+    def refresh_counters(self, users=None):
+        """
+        Recompute the denormalized profile counters in a single UPDATE.
+
+        :param users: queryset of users to refresh, all users by default
+        :return: number of users updated
+        """
+        def count(queryset, owner):
+            totals = queryset.filter(**{owner: OuterRef('pk')}).order_by().values(owner).annotate(total=Count('id'))
+            return Coalesce(Subquery(totals.values('total'), output_field=IntegerField()), 0)
+
+        users = self.all() if users is None else users
+        return users.update(events_count=count(Event.objects.all(), 'user_id'),
+                            participants_count=count(EventMember.objects.all(), 'event__user_id'),
+                            friends_count=count(User.ref_user.through.objects.all(), 'from_user_id'))
+
 
 def upload_profile_image(instance, filename):
-    user = User.objects.get(id=instance.id)
-    return '{}/{}/{}'.format("Users", user.id, 'profile_image.jpg')
+    return '{}/{}/{}'.format("Users", instance.id, 'profile_image.jpg')
 
 
 class User(AbstractBaseUser):
     image = models.ImageField(upload_to=upload_profile_image, blank=True, null=True)
+    thumbnails_ready = models.BooleanField(default=False, editable=False)
     email = models.EmailField(unique=True)
     first_name = models.CharField(max_length=150, null=True, blank=True, default='')
     last_name = models.CharField(max_length=150, null=True, blank=True, default='')
@@ -48,9 +70,16 @@ class User(AbstractBaseUser):
     username = models.CharField(max_length=50)
     account_id = models.CharField(max_length=10, null=True, blank=True)
     phone_number = models.CharField(max_length=150, null=True, blank=True)
+    phone_key = models.CharField(max_length=16, null=True, blank=True, db_index=True, editable=False)
     temporary_profile = models.BooleanField(default=True)
     address = models.CharField(max_length=150, null=True, blank=True)
     ref_user = models.ManyToManyField('self', null=True)
+    events_count = models.IntegerField(default=0, editable=False)
+    participants_count = models.IntegerField(default=0, editable=False)
+    friends_count = models.IntegerField(default=0, editable=False)
+    # Bumped whenever the friends or contacts list of this user would render differently.
+    friends_version = models.IntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     is_staff = models.BooleanField(
         ('staff status'),
@@ -98,6 +127,20 @@ class User(AbstractBaseUser):
     USERNAME_FIELD = 'email'
     objects = UserManager()
 
+    # Kept up to date with F() updates by signals; code holding an instance that may be older
+    # than these columns saves with update_fields.
+    COUNTER_FIELDS = ('events_count', 'participants_count', 'friends_count', 'friends_version')
+
+    def save(self, *args, **kwargs):
+        self.phone_key = normalize_phone_number(self.phone_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = {'updated_at'} if update_fields != ['last_login'] else set()
+            if 'phone_number' in update_fields:
+                extra.add('phone_key')
+            kwargs['update_fields'] = set(update_fields) | extra
+        super(User, self).save(*args, **kwargs)
+
     def __str__(self):
         return str(self.id)
 
@@ -133,7 +176,30 @@ class Event(models.Model):
     latitude = models.FloatField(null=True, blank=True, default=0.0)
     location_name = models.CharField(max_length=150)
     location_address = models.CharField(max_length=200)
+    geohash = models.CharField(max_length=12, null=True, blank=True, db_index=True, editable=False)
     user = models.ForeignKey(User)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Bumped when comments, reactions or members of the event change.
+    version = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        index_together = (("user", "created_at"), ("user", "scheduled_time"))
+
+    def save(self, *args, **kwargs):
+        self.geohash = None
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = {'updated_at'}
+            if {'latitude', 'longitude'} & set(update_fields):
+                extra.add('geohash')
+            kwargs['update_fields'] = set(update_fields) | extra
+        elif not self._state.adding and not kwargs.get('force_insert'):
+            # version is only written with F() updates.
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name != 'version']
+        super(Event, self).save(*args, **kwargs)
 
     def __str__(self):
         return str(self.id)
@@ -145,6 +211,9 @@ class Comment(models.Model):
     message = models.CharField(max_length=200)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        index_together = (("event", "created_at"),)
+
     def __str__(self):
         return str(self.id)
 
@@ -154,6 +223,9 @@ class EventReaction(models.Model):
     user = models.ForeignKey(User)
     reaction = models.NullBooleanField(null=True)
 
+    class Meta:
+        unique_together = ("event", "user")
+
     def __str__(self):
         return str(self.id)
 
@@ -181,6 +253,9 @@ class EventMember(models.Model):
     event = models.ForeignKey(Event)
     follow = models.BooleanField(default=False)
 
+    class Meta:
+        unique_together = ("event", "user")
+
     def __str__(self):
         return str(self.id)
 
@@ -194,3 +269,130 @@ class EventWishList(models.Model):
 
     def __str__(self):
         return str(self.id)
+
+
+class FeedEntry(models.Model):
+    owner = models.ForeignKey(User, related_name='feed_entries')
+    event = models.ForeignKey(Event)
+    author = models.ForeignKey(User, related_name='+')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("owner", "event")
+        index_together = (("owner", "created_at", "event"),)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUS = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed')
+    )
+    name = models.CharField(max_length=100)
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=20, choices=STATUS, default=QUEUED)
+    result = models.TextField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    user = models.ForeignKey(User, null=True, blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    leased_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        index_together = (("status", "run_after"),)
+
+    def __str__(self):
+        return str(self.id)
+
+
+@receiver(post_save, sender=Event)
+def increment_events_count(sender, instance=None, created=False, **kwargs):
+    if created:
+        User.objects.filter(id=instance.user_id).update(events_count=F('events_count') + 1)
+
+
+@receiver(post_delete, sender=Event)
+def decrement_events_count(sender, instance=None, **kwargs):
+    User.objects.filter(id=instance.user_id).update(events_count=F('events_count') - 1)
+
+
+@receiver(post_save, sender=EventMember)
+def increment_participants_count(sender, instance=None, created=False, **kwargs):
+    if created:
+        User.objects.filter(event=instance.event_id).update(participants_count=F('participants_count') + 1)
+
+
+@receiver(post_delete, sender=EventMember)
+def decrement_participants_count(sender, instance=None, **kwargs):
+    User.objects.filter(event=instance.event_id).update(participants_count=F('participants_count') - 1)
+
+
+def bump_event_versions(events):
+    events.update(version=F('version') + 1)
+
+
+def bump_friends_versions(users):
+    users.update(friends_version=F('friends_version') + 1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=EventReaction)
+@receiver(post_delete, sender=EventReaction)
+def bump_event_activity_version(sender, instance=None, **kwargs):
+    bump_event_versions(Event.objects.filter(id=instance.event_id))
+
+
+@receiver(post_save, sender=EventMember)
+@receiver(post_delete, sender=EventMember)
+def bump_event_member_version(sender, instance=None, **kwargs):
+    # Latest events in friends lists show their members.
+    bump_event_versions(Event.objects.filter(id=instance.event_id))
+    bump_friends_versions(User.objects.filter(ref_user__event=instance.event_id))
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def bump_event_friends_version(sender, instance=None, **kwargs):
+    bump_friends_versions(User.objects.filter(ref_user=instance.user_id))
+
+
+@receiver(post_save, sender=User)
+def bump_user_versions(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created or update_fields == frozenset(['last_login']):
+        return
+    # Names show up in friends lists and in the members and comments of events.
+    bump_friends_versions(User.objects.filter(ref_user=instance.id))
+    bump_event_versions(Event.objects.filter(eventmember__user=instance.id))
+    bump_event_versions(Event.objects.filter(comment__user=instance.id))
+
+
+@receiver(m2m_changed, sender=User.ref_user.through)
+def bump_friendship_versions(sender, instance=None, action=None, pk_set=None, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        user_ids = set(pk_set or getattr(instance, '_cleared_friend_ids', ()))
+        user_ids.add(instance.pk)
+        bump_friends_versions(User.objects.filter(id__in=user_ids))
+
+
+@receiver(m2m_changed, sender=User.ref_user.through)
+def refresh_friends_count(sender, instance=None, action=None, pk_set=None, **kwargs):
+    # A symmetrical add or remove touches both sides, so both are recounted.
+    if action == 'pre_clear':
+        instance._cleared_friend_ids = list(instance.ref_user.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        user_ids = set(pk_set or getattr(instance, '_cleared_friend_ids', ()))
+        user_ids.add(instance.pk)
+        User.objects.refresh_counters(User.objects.filter(id__in=user_ids))
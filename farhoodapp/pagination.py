@@ -0,0 +1,218 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+
+from farhoodapp.utils import CustomResponse
+
+
+def encode_position(value):
+    # Full precision, DjangoJSONEncoder would cut microseconds and break the seek.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError('{!r} is not a cursor value'.format(value))
+
+
+def sequence_value(value_type):
+    """Converter of a decoded cursor value to the numeric ``value_type``, rejecting anything else."""
+    def convert(value):
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise TypeError('{!r} is not a number'.format(value))
+        return value_type(value)
+    return convert
+
+
+def position_of(item, fields):
+    """Values of the ordering ``fields`` of a model instance or a ``.values()`` row."""
+    if isinstance(item, dict):
+        return tuple(item[name] for name in fields)
+    return tuple(getattr(item, name) for name in fields)
+
+
+class KeysetPagination(object):
+    """
+    Opaque-cursor pagination that seeks on the ordering columns instead of using OFFSET,
+    so every page costs the same however deep the client has scrolled.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.next_cursor = None
+        self.previous_cursor = None
+
+    def get_page_size(self, request):
+        page_size = settings.PAGINATION['PAGE_SIZE']
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, page_size))
+        except (TypeError, ValueError):
+            pass
+        return max(1, min(page_size, settings.PAGINATION['MAX_PAGE_SIZE']))
+
+    def get_cache_key(self):
+        return '{}:{}'.format(self.request.query_params.get(self.cursor_query_param, ''), self.page_size)
+
+    def paginate_queryset(self, queryset, ordering):
+        """
+        :param queryset: unsliced queryset to page through, of model instances or ``.values()`` rows
+        :param ordering: field names forming a unique ordering, all ascending or all descending ('-')
+        :return: list with the objects of the requested page
+        """
+        return self.paginate_querysets([(queryset, ordering)])
+
+    def paginate_querysets(self, sources):
+        """
+        Page through the union of several querysets sorted on comparable keys,
+        e.g. materialized feed entries merged with events pulled on read.
+
+        :param sources: (queryset, ordering) pairs; every ordering has the same length and direction,
+            and objects from different sources with equal keys are the same item
+        :return: list with the objects of the requested page
+        """
+        queryset, ordering = sources[0]
+        position, reverse = self.decode_cursor(
+            [queryset.model._meta.get_field(name.lstrip('-')).to_python for name in ordering])
+        descending = ordering[0].startswith('-')
+        if reverse:
+            descending = not descending
+
+        merged = {}
+        for queryset, ordering in sources:
+            fields = [name.lstrip('-') for name in ordering]
+            if position is not None:
+                queryset = queryset.filter(self.seek_filter(fields, position, descending))
+            queryset = queryset.order_by(*[('-' if descending else '') + name for name in fields])
+            for obj in queryset[:self.page_size + 1]:
+                merged.setdefault(position_of(obj, fields), obj)
+
+        keys = sorted(merged, reverse=descending)
+        has_more = len(keys) > self.page_size
+        keys = keys[:self.page_size]
+        if reverse:
+            keys.reverse()
+        if keys:
+            has_next, has_previous = (True, has_more) if reverse else (has_more, position is not None)
+            if has_next:
+                self.next_cursor = self.encode_position(keys[-1], reverse=False)
+            if has_previous:
+                self.previous_cursor = self.encode_position(keys[0], reverse=True)
+        return [merged[key] for key in keys]
+
+    def paginate_sequence(self, items, key, types):
+        """
+        Page through objects sorted in memory, e.g. by a computed distance.
+
+        :param items: objects sorted ascending by ``key``
+        :param key: function returning a unique tuple of JSON-serializable values for an object
+        :param types: numeric type of each value of the key tuple, e.g. (float, int)
+        :return: list with the objects of the requested page
+        """
+        position, reverse = self.decode_cursor([sequence_value(value_type) for value_type in types])
+        if position is not None:
+            position = tuple(position)
+            if reverse:
+                items = [item for item in items if key(item) < position][::-1]
+            else:
+                items = [item for item in items if key(item) > position]
+        results = items[:self.page_size]
+        has_more = len(items) > self.page_size
+        if reverse:
+            results.reverse()
+        if results:
+            has_next, has_previous = (True, has_more) if reverse else (has_more, position is not None)
+            if has_next:
+                self.next_cursor = self.encode_position(key(results[-1]), reverse=False)
+            if has_previous:
+                self.previous_cursor = self.encode_position(key(results[0]), reverse=True)
+        return results
+
+    def get_paginated_response(self, data):
+        response = CustomResponse.create_response(True, status.HTTP_200_OK, "Success", data)
+        response.data['next'] = self.next_cursor
+        response.data['previous'] = self.previous_cursor
+        return response
+
+    @staticmethod
+    def seek_filter(fields, position, descending):
+        lookup = 'lt' if descending else 'gt'
+        seek, equal = Q(), Q()
+        for name, value in zip(fields, position):
+            seek |= equal & Q(**{'{}__{}'.format(name, lookup): value})
+            equal &= Q(**{name: value})
+        return seek
+
+    @staticmethod
+    def encode_position(position, reverse):
+        payload = {'p': list(position), 'r': int(reverse)}
+        data = json.dumps(payload, default=encode_position, separators=(',', ':')).encode('utf-8')
+        return base64.urlsafe_b64encode(data).decode('ascii')
+
+    def decode_cursor(self, converters=None):
+        cursor = self.request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        return self.parse_cursor(cursor, converters)
+
+    def parse_cursor(self, cursor, converters=None):
+        """
+        :param converters: one function per ordering field turning a decoded value into the field's
+            type, raising TypeError, ValueError or ValidationError on a value of the wrong kind
+        """
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            position, reverse = list(payload['p']), bool(payload['r'])
+            if converters is not None:
+                if len(position) != len(converters) or None in position:
+                    raise ValueError('cursor does not match the ordering')
+                position = [convert(value) for convert, value in zip(converters, position)]
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+
+class ThreadPagination(KeysetPagination):
+    """
+    Keyset pagination over a newest-first thread: ``before`` pages towards older items
+    and ``after`` fetches the items newer than a position, e.g. to poll for new comments.
+    """
+    before_query_param = 'before'
+    after_query_param = 'after'
+
+    def get_cache_key(self):
+        params = self.request.query_params
+        return '{}:{}:{}'.format(params.get(self.before_query_param, ''), params.get(self.after_query_param, ''),
+                                 self.page_size)
+
+    def decode_cursor(self, converters=None):
+        for name, reverse in ((self.before_query_param, False), (self.after_query_param, True)):
+            cursor = self.request.query_params.get(name)
+            if cursor:
+                position, _ = self.parse_cursor(cursor, converters)
+                return position, reverse
+        return None, False
+
+    def paginate_queryset(self, queryset, ordering):
+        results = super(ThreadPagination, self).paginate_queryset(queryset, ordering)
+        if results and self.previous_cursor is None:
+            # The newest page still gets an ``after`` cursor to poll from.
+            fields = [name.lstrip('-') for name in ordering]
+            self.previous_cursor = self.encode_position(position_of(results[0], fields), reverse=True)
+        elif not results:
+            # Nothing newer yet, keep polling from the same position.
+            self.previous_cursor = self.request.query_params.get(self.after_query_param)
+        return results
+
+    def get_paginated_response(self, data):
+        response = CustomResponse.create_response(True, status.HTTP_200_OK, "Success", data)
+        response.data['before'] = self.next_cursor
+        response.data['after'] = self.previous_cursor
+        return response
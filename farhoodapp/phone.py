@@ -0,0 +1,64 @@
+import re
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, CharField, Value, When
+
+NON_DIGITS = re.compile(r'\D')
+NATIONAL_NUMBER_MAX_LENGTH = 10
+E164_MIN_LENGTH = 4
+E164_MAX_LENGTH = 15
+BACKFILL_CHUNK_SIZE = 300
+
+
+def normalize_phone_number(phone_number, country_code=None):
+    """
+    Canonical E.164 key for a free-form phone number, e.g. "(555) 010-0199" -> "+15550100199".
+
+    :param phone_number: number as typed by the user or found in an address book
+    :param country_code: calling code for national numbers, defaults to settings.PHONE_NUMBER_DEFAULT_COUNTRY_CODE
+    :return: normalized number or None when it cannot be a phone number
+    """
+    if not phone_number:
+        return None
+    value = str(phone_number).strip()
+    digits = NON_DIGITS.sub('', value)
+    if value.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    else:
+        digits = digits.lstrip('0')
+        if len(digits) <= NATIONAL_NUMBER_MAX_LENGTH:
+            digits = (country_code or settings.PHONE_NUMBER_DEFAULT_COUNTRY_CODE) + digits
+    if not E164_MIN_LENGTH <= len(digits) <= E164_MAX_LENGTH:
+        return None
+    return '+' + digits
+
+
+def backfill_phone_keys(user_model, chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Recompute ``phone_key`` for every user in primary key order, one UPDATE per chunk.
+
+    :param user_model: User model, the historical one when called from a migration
+    :param chunk_size: number of users read and written per statement
+    :return: number of users whose key changed
+    """
+    last_id, updated = 0, 0
+    while True:
+        rows = list(user_model.objects.filter(id__gt=last_id).order_by('id')
+                    .values_list('id', 'phone_number', 'phone_key')[:chunk_size])
+        if not rows:
+            return updated
+        last_id = rows[-1][0]
+        changes = {}
+        for user_id, phone_number, phone_key in rows:
+            normalized = normalize_phone_number(phone_number)
+            if normalized != phone_key:
+                changes[user_id] = normalized
+        if changes:
+            whens = [When(id=user_id, then=Value(phone_key)) for user_id, phone_key in changes.items()]
+            with transaction.atomic():
+                user_model.objects.filter(id__in=list(changes)).update(
+                    phone_key=Case(*whens, output_field=CharField()))
+            updated += len(changes)
@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+broker_lock = threading.Lock()
+brokers = {}
+
+
+class LocalBroker(object):
+    """
+    Pub/sub between the threads of one process; subscribers block on a condition variable.
+
+    Every channel keeps its last ``retention`` messages, numbered from one increasing
+    sequence, so a reader that reconnects with the last id it saw gets what it missed.
+    """
+
+    def __init__(self, retention=100, max_channels=10000):
+        self.retention = retention
+        self.max_channels = max_channels
+        self.condition = threading.Condition()
+        self.channels = OrderedDict()
+        self.sequence = 0
+
+    def publish(self, channel, message):
+        with self.condition:
+            messages = self.channels.pop(channel, None)
+            if messages is None:
+                messages = deque(maxlen=self.retention)
+            self.sequence += 1
+            messages.append((self.sequence, message))
+            self.channels[channel] = messages
+            while len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+            self.condition.notify_all()
+
+    def last_id(self, channel):
+        with self.condition:
+            return self.sequence
+
+    def read(self, channel, after, timeout):
+        """
+        :param channel: channel name
+        :param after: id of the last message the reader has seen
+        :param timeout: seconds to wait for a first message
+        :return: list of ``(id, message)`` published after ``after``, empty on timeout
+        """
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                messages = [item for item in self.channels.get(channel, ()) if item[0] > after]
+                remaining = deadline - time.time()
+                if messages or remaining <= 0:
+                    return messages
+                self.condition.wait(remaining)
+
+
+class CacheBroker(object):
+    """
+    Pub/sub through a cache shared by every process (memcached, redis), for multi-process deployments.
+
+    Publishers number messages with ``incr`` on a per-channel counter, which memcached and
+    redis apply atomically; the file and database caches do a get and a set and may hand out
+    an id twice. Readers poll the counter every ``poll_interval`` seconds and fetch the
+    messages they have not seen with one ``get_many``.
+    """
+
+    def __init__(self, alias='default', retention=100, poll_interval=0.5, timeout=300):
+        self.cache = caches[alias]
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def counter_key(self, channel):
+        return 'pubsub:{}'.format(channel)
+
+    def message_key(self, channel, message_id):
+        return 'pubsub:{}:{}'.format(channel, message_id)
+
+    def publish(self, channel, message):
+        key = self.counter_key(channel)
+        # incr never refreshes a TTL, an expiring counter would restart below what readers have seen.
+        self.cache.add(key, 0, None)
+        message_id = self.cache.incr(key)
+        self.cache.set(self.message_key(channel, message_id), message, self.timeout)
+
+    def last_id(self, channel):
+        return self.cache.get(self.counter_key(channel)) or 0
+
+    def read(self, channel, after, timeout):
+        deadline = time.time() + timeout
+        while True:
+            last_id = self.last_id(channel)
+            if last_id < after:
+                # The counter was evicted and restarted, every id up to last_id is a new message.
+                after = 0
+            if last_id > after:
+                ids = range(max(after + 1, last_id - self.retention + 1), last_id + 1)
+                found = self.cache.get_many([self.message_key(channel, message_id) for message_id in ids])
+                messages = [(message_id, found[self.message_key(channel, message_id)]) for message_id in ids
+                            if self.message_key(channel, message_id) in found]
+                if messages:
+                    return messages
+                after = last_id
+            if time.time() >= deadline:
+                return []
+            time.sleep(self.poll_interval)
+
+
+def get_broker():
+    backend = settings.PUBSUB['BACKEND']
+    with broker_lock:
+        if backend not in brokers:
+            brokers[backend] = import_string(backend)(**settings.PUBSUB.get('OPTIONS', {}))
+        return brokers[backend]
+
+
+def event_channel(event_id):
+    return 'event:{}'.format(event_id)
+
+
+def publish_event_activity(event_id, kind, action, data):
+    """Push a change of an event to its stream subscribers once the transaction commits."""
+    channel = event_channel(event_id)
+    message = {'type': kind, 'action': action, 'data': dict(data)}
+    transaction.on_commit(lambda: get_broker().publish(channel, message))
+
+
+def parse_message_id(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def sse_stream(channel, after=None):
+    """
+    Server-sent events for ``channel`` until settings.PUBSUB['STREAM_TIMEOUT'] runs out;
+    ``after`` resumes from a Last-Event-ID, otherwise only new messages are sent.
+    """
+    broker = get_broker()
+    after = broker.last_id(channel) if after is None else after
+    deadline = time.time() + settings.PUBSUB['STREAM_TIMEOUT']
+    yield 'retry: {}\n\n'.format(settings.PUBSUB['RETRY'] * 1000)
+    while time.time() < deadline:
+        messages = broker.read(channel, after, min(settings.PUBSUB['KEEPALIVE'], deadline - time.time()))
+        if not messages:
+            yield ': keepalive\n\n'
+        for message_id, message in messages:
+            after = message_id
+            yield 'id: {}\nevent: {}\ndata: {}\n\n'.format(message_id, message['type'], json.dumps(message))
@@ -0,0 +1,134 @@
+"""
+Output of the list serializers built straight from ``.values()`` rows.
+
+Each ``*_values`` function narrows a queryset to the columns a serializer reads, and the
+matching ``serialize_*`` function turns a page of those rows into the same dicts, in the
+same key order, as EventSerializer, FriendsSerializer, EventMemberFriendSerializer and
+EventCommentSerializer, without instantiating models or running DRF fields.
+"""
+from farhoodapp.models import Event, EventMember
+from farhoodapp.serializers import EventSerializer
+from farhoodapp.utils import chunked, QUERY_BATCH_SIZE
+
+EVENT_COLUMNS = {
+    'id': ('id',),
+    'name': ('name',),
+    'event_type': ('event_type',),
+    'created_at': ('created_at',),
+    'description': ('description',),
+    'scheduled_time': ('scheduled_time',),
+    'longitude': ('longitude',),
+    'latitude': ('latitude',),
+    'location_name': ('location_name',),
+    'location_address': ('location_address',),
+    'user': ('user_id',),
+    'user_name': ('user__first_name', 'user__last_name'),
+    'members': (),
+}
+
+# Ordering columns of the event lists, always loaded so any selection can be paginated.
+EVENT_KEY_COLUMNS = ('id', 'created_at', 'scheduled_time')
+
+
+def datetime_value(value):
+    """A datetime as DRF renders it: ISO 8601 with 'Z' for UTC."""
+    if not value:
+        return None
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def float_value(value):
+    return None if value is None else float(value)
+
+
+def event_fields(selection=None):
+    return [name for name in EventSerializer.Meta.fields if EventSerializer.selects(selection, name)]
+
+
+def event_values(events, selection=None):
+    columns = list(EVENT_KEY_COLUMNS)
+    for name in event_fields(selection):
+        columns.extend(column for column in EVENT_COLUMNS[name] if column not in columns)
+    return events.values(*columns)
+
+
+def member_rows(event_ids):
+    """FollowEventMemberSerializer output of the members of each event, by event id."""
+    members = {}
+    for batch in chunked(event_ids, QUERY_BATCH_SIZE):
+        rows = EventMember.objects.filter(event_id__in=batch).order_by('id').values_list(
+            'id', 'follow', 'user_id', 'event_id')
+        for member_id, follow, user_id, event_id in rows:
+            members.setdefault(event_id, []).append(
+                {'id': member_id, 'follow': follow, 'user': user_id, 'event': event_id})
+    return members
+
+
+def serialize_events(rows, selection=None):
+    """
+    :param rows: dicts from ``event_values`` with the same ``selection``
+    :return: list of EventSerializer data
+    """
+    fields = event_fields(selection)
+    members = member_rows([row['id'] for row in rows]) if 'members' in fields else {}
+    result = []
+    for row in rows:
+        data = {}
+        for name in fields:
+            if name in ('created_at', 'scheduled_time'):
+                data[name] = datetime_value(row[name])
+            elif name in ('longitude', 'latitude'):
+                data[name] = float_value(row[name])
+            elif name == 'user':
+                data[name] = row['user_id']
+            elif name == 'user_name':
+                data[name] = '{} {}'.format(row['user__first_name'], row['user__last_name'])
+            elif name == 'members':
+                data[name] = members.get(row['id'], [])
+            else:
+                data[name] = row[name]
+        result.append(data)
+    return result
+
+
+def friend_values(users):
+    """:param users: users annotated with ``latest_event_id``"""
+    return users.values('id', 'first_name', 'phone_number', 'latest_event_id')
+
+
+def serialize_friends(rows):
+    """
+    :param rows: dicts from ``friend_values``
+    :return: list of FriendsSerializer data, with the latest events loaded in bulk
+    """
+    event_ids = [row['latest_event_id'] for row in rows if row['latest_event_id']]
+    latest_events = {}
+    for batch in chunked(event_ids, QUERY_BATCH_SIZE):
+        for data in serialize_events(list(event_values(Event.objects.filter(id__in=batch)))):
+            latest_events[data['id']] = data
+    return [{'name': row['first_name'], 'event': latest_events.get(row['latest_event_id'], {}),
+             'user_id': row['id'], 'phone_number': row['phone_number']} for row in rows]
+
+
+def event_member_values(members):
+    return members.values('id', 'follow', 'event_id', 'event__name', 'event__user_id')
+
+
+def serialize_event_members(rows):
+    """:return: list of EventMemberFriendSerializer data"""
+    return [{'id': row['id'], 'follow': row['follow'],
+             'event': {'id': row['event_id'], 'name': row['event__name'], 'user': row['event__user_id']}}
+            for row in rows]
+
+
+def comment_values(comments):
+    return comments.values('id', 'message', 'created_at', 'event_id', 'user_id')
+
+
+def serialize_comments(rows):
+    """:return: list of EventCommentSerializer data"""
+    return [{'id': row['id'], 'message': row['message'], 'created_at': datetime_value(row['created_at']),
+             'event': row['event_id'], 'user': row['user_id']} for row in rows]
@@ -1,11 +1,64 @@
+import json
 import re
 
+from django.conf import settings
 from django.core.validators import RegexValidator
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 from rest_framework.validators import UniqueValidator
 
-from farhoodapp.models import (Event, User, Comment, Action, EventMember, EventReaction, EventWishList, )
+from farhoodapp.images import thumbnail_url
+from farhoodapp.models import (Event, User, Comment, Action, EventMember, EventReaction, EventWishList, Job, )
+
+
+class FieldSelection(object):
+    """
+    Fields requested with ``?fields=a,b`` and ``?expand=c``. Without either parameter every
+    field is rendered as before; with one of them the serializer's expandable fields are
+    only rendered when listed.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = fields
+        self.expand = expand or set()
+        self.active = fields is not None or expand is not None
+
+    @classmethod
+    def from_request(cls, request):
+        def names(param):
+            value = request.query_params.get(param)
+            return None if value is None else set(name for name in value.split(',') if name)
+        return cls(names('fields'), names('expand'))
+
+    def includes(self, name, expandable):
+        if not self.active or name in self.expand:
+            return True
+        if self.fields is not None:
+            return name in self.fields
+        return name not in expandable
+
+    def cache_key(self):
+        if not self.active:
+            return ''
+        fields = '*' if self.fields is None else ','.join(sorted(self.fields))
+        return '{}|{}'.format(fields, ','.join(sorted(self.expand)))
+
+
+class SelectableFieldsMixin(object):
+    """Takes a ``selection`` FieldSelection and drops the fields it does not include."""
+    expandable_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        selection = kwargs.pop('selection', None)
+        super(SelectableFieldsMixin, self).__init__(*args, **kwargs)
+        if selection is not None:
+            for name in list(self.fields):
+                if not selection.includes(name, self.expandable_fields):
+                    del self.fields[name]
+
+    @classmethod
+    def selects(cls, selection, name):
+        return selection is None or selection.includes(name, cls.expandable_fields)
 
 
 class EmailValidator(object):
@@ -34,7 +87,7 @@ class UserSerializer(serializers.ModelSerializer):
         user = User.objects._create_user(validated_data.get('email'), validated_data.get('password'))
         if validated_data.get('phone_number'):
             user.phone_number = validated_data.get('phone_number')
-            user.save()
+            user.save(update_fields=['phone_number'])
         return user
 
     class Meta:
@@ -82,7 +135,7 @@ class ProfileSerializer(serializers.ModelSerializer):
         user = User.objects._create_user(validated_data.get('email'), validated_data.get('password'))
         if validated_data.get('phone_number'):
             user.phone_number = validated_data.get('phone_number')
-            user.save()
+            user.save(update_fields=['phone_number'])
         return user
 
     class Meta:
@@ -122,6 +175,12 @@ class ProfileUpdateSerializer(ModelSerializer):
         model = User
         fields = ('phone_number', 'first_name', 'last_name', 'nick_name', 'username', 'address', 'image',)
 
+    def update(self, instance, validated_data):
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 
 class TemporaryUserSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
@@ -139,7 +198,11 @@ class FriendsSerializer(serializers.ModelSerializer):
     user_id = serializers.SerializerMethodField()
 
     def get_event(self, obj):
-        event = Event.objects.filter(user_id=obj).order_by('-id').first()
+        latest_events = self.context.get('latest_events')
+        if latest_events is None:
+            event = Event.objects.filter(user_id=obj).order_by('-id').first()
+        else:
+            event = latest_events.get(obj.latest_event_id)
         if event:
             return EventSerializer(event).data
         else:
@@ -160,7 +223,7 @@ class FriendsEventSerializer(serializers.Serializer):
     ref_users = serializers.SerializerMethodField()
 
     def get_ref_users(self, obj):
-        ref_users = FriendsSerializer(obj, many=True)
+        ref_users = FriendsSerializer(obj, many=True, context=self.context)
         return ref_users.data
 
     class Meta:
@@ -192,9 +255,15 @@ class UserFriendEventSerializer(ModelSerializer):
 
 
 class UserImageSerializer(ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
+
+    def get_thumbnails(self, obj):
+        request = self.context.get('request')
+        return {str(size): thumbnail_url(obj, size, request) for size in settings.PROFILE_IMAGE['SIZES']}
+
     class Meta:
         model = User
-        fields = ('image',)
+        fields = ('image', 'thumbnails',)
 
 
 class EventMemberSerializer(ModelSerializer):
@@ -216,17 +285,14 @@ class UserEventMemberSerializer(ModelSerializer):
     phone_number = serializers.SerializerMethodField()
 
     def get_user_id(self, obj):
-        userr = User.objects.filter(id=obj.user.id).first()
-        return userr.id
+        return obj.user.id
 
     def get_name(self, obj):
-        userr = User.objects.filter(id=obj.user.id).first()
-        name = '{} {}'.format(str(userr.first_name), str(userr.last_name))
+        name = '{} {}'.format(str(obj.user.first_name), str(obj.user.last_name))
         return name
 
     def get_phone_number(self, obj):
-        userr = User.objects.filter(id=obj.user.id).first()
-        return userr.phone_number
+        return obj.user.phone_number
 
     class Meta:
         model = EventMember
@@ -243,23 +309,28 @@ class UserProfileSerializer(ModelSerializer):
     name = serializers.SerializerMethodField()
     no_of_events = serializers.SerializerMethodField()
     participants = serializers.SerializerMethodField()
+    no_of_friends = serializers.SerializerMethodField()
+    image_thumbnail = serializers.SerializerMethodField()
+
+    def get_image_thumbnail(self, obj):
+        return thumbnail_url(obj, settings.PROFILE_IMAGE['PROFILE_SIZE'], self.context.get('request'))
 
     def get_name(self, obj):
         name = '{} {}'.format(obj.first_name, obj.last_name)
         return name
 
     def get_no_of_events(self, obj):
-        events = Event.objects.filter(user_id=obj).count()
-        return events
+        return obj.events_count
 
     def get_participants(self, obj):
-        events = Event.objects.filter(user_id=obj)
-        participant = EventMember.objects.filter(event__in=events).count()
-        return participant
+        return obj.participants_count
+
+    def get_no_of_friends(self, obj):
+        return obj.friends_count
 
     class Meta:
         model = User
-        fields = ('id', 'name', 'image', 'no_of_events', 'participants',)
+        fields = ('id', 'name', 'image', 'image_thumbnail', 'no_of_events', 'participants', 'no_of_friends',)
 
 
 class CombineNameSerializer(ModelSerializer):
@@ -286,6 +357,12 @@ class CommentUserSerializer(ModelSerializer):
         fields = ('user', 'event', 'message', 'name')
 
 
+class CommentThreadSerializer(CommentUserSerializer):
+    class Meta:
+        model = Comment
+        fields = ('id', 'user', 'event', 'message', 'name', 'created_at')
+
+
 class EventReactionUserSerializer(ModelSerializer):
     name = serializers.SerializerMethodField()
 
@@ -297,15 +374,19 @@ class EventReactionUserSerializer(ModelSerializer):
         fields = ('user', 'event', 'reaction', 'name')
 
 
-class UserEventSerializer(ModelSerializer):
+class UserEventSerializer(SelectableFieldsMixin, ModelSerializer):
+    expandable_fields = ('event_member', 'comments', 'comments_count', 'reaction')
     user = serializers.SerializerMethodField()
     user_id = serializers.SerializerMethodField()
     event_member = serializers.SerializerMethodField()
     comments = serializers.SerializerMethodField()
+    comments_count = serializers.SerializerMethodField()
     reaction = serializers.SerializerMethodField()
 
     def get_event_member(self, obj):
-        member = EventMember.objects.filter(event_id=obj, follow=True)
+        member = getattr(obj, 'followed_members', None)
+        if member is None:
+            member = EventMember.objects.filter(event_id=obj, follow=True).select_related('user')
         result = UserEventMemberSerializer(member, many=True)
         return result.data
 
@@ -317,17 +398,29 @@ class UserEventSerializer(ModelSerializer):
         return obj.user.id
 
     def get_comments(self, obj):
-        comments = Comment.objects.filter(event=obj).order_by('-created_at')
+        comments = getattr(obj, 'latest_comments', None)
+        if comments is None:
+            comments = Comment.objects.filter(event=obj).select_related('user').order_by('-created_at', '-id')
+            comments = comments[:settings.EVENT_DETAIL_COMMENTS]
         return CommentUserSerializer(comments, many=True).data
 
+    def get_comments_count(self, obj):
+        count = getattr(obj, 'comments_count', None)
+        return obj.comment_set.count() if count is None else count
+
     def get_reaction(self, obj):
-        reaction = EventReaction.objects.filter(event=obj).first()
+        reactions = getattr(obj, 'ordered_reactions', None)
+        if reactions is None:
+            reaction = EventReaction.objects.filter(event=obj).first()
+        else:
+            reaction = reactions[0] if reactions else None
         return UserEventReactionSerializer(reaction, many=False).data
 
     class Meta:
         model = Event
         fields = ('id', 'name', 'event_type', 'created_at', 'description', 'scheduled_time', 'longitude', 'latitude',
-                  'location_name', 'location_address', 'user', 'user_id', 'event_member', 'comments', 'reaction')
+                  'location_name', 'location_address', 'user', 'user_id', 'event_member', 'comments', 'comments_count',
+                  'reaction')
 
 
 class EventFriendSerializer(ModelSerializer):
@@ -374,12 +467,13 @@ class EventUserSerializer(ModelSerializer):
         fields = ('first_name', 'last_name',)
 
 
-class EventSerializer(ModelSerializer):
+class EventSerializer(SelectableFieldsMixin, ModelSerializer):
+    expandable_fields = ('members', 'user_name')
     user_name = serializers.SerializerMethodField()
     members = serializers.SerializerMethodField()
 
     def get_members(self, event):
-        members = EventMember.objects.filter(event=event)
+        members = event.eventmember_set.all()
         return FollowEventMemberSerializer(members, many=True).data
 
     def create(self, validated_data):
@@ -395,8 +489,7 @@ class EventSerializer(ModelSerializer):
         return event
 
     def get_user_name(self, obj):
-        user = User.objects.filter(id=obj.user.id).first()
-        name = '{} {}'.format(str(user.first_name), str(user.last_name))
+        name = '{} {}'.format(str(obj.user.first_name), str(obj.user.last_name))
         return name
 
     class Meta:
@@ -498,3 +591,14 @@ class AddEventMemberSerializer(ModelSerializer):
     class Meta:
         model = EventMember
         fields = '__all__'
+
+
+class JobSerializer(ModelSerializer):
+    result = serializers.SerializerMethodField()
+
+    def get_result(self, obj):
+        return json.loads(obj.result) if obj.result else None
+
+    class Meta:
+        model = Job
+        fields = ('id', 'name', 'status', 'attempts', 'result', 'error', 'created_at', 'updated_at')
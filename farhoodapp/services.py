@@ -1,31 +1,294 @@
-from farhoodapp.models import Event, Comment, Action, EventMember, User
-from farhoodapp.serializers import (UserEventSerializer, EventCommentSerializer, EventActionSerializer,
-                                    EventMemberFriendSerializer, UserProfileSerializer,
-                                    UserImageSerializer, FriendsEventSerializer)
+import hashlib
+import threading
+import uuid
+from collections import Counter, defaultdict
 
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from farhoodapp.geo import bounding_box, covering_cells, haversine
+from farhoodapp.models import Event, Comment, Action, EventMember, EventReaction, FeedEntry, User
+from farhoodapp.pubsub import publish_event_activity
+from farhoodapp.rows import (comment_values, event_member_values, event_values, friend_values, serialize_comments,
+                             serialize_event_members, serialize_events, serialize_friends)
+from farhoodapp.serializers import (UserEventSerializer, EventActionSerializer, UserProfileSerializer,
+                                    CommentThreadSerializer, UserImageSerializer, EventReactionSerializer,
+                                    FollowEventMemberSerializer)
+from farhoodapp.utils import chunked, QUERY_BATCH_SIZE
+
+cache_stats = defaultdict(Counter)
+cache_stats_lock = threading.Lock()
+
+
+def get_response_cache():
+    return caches[settings.RESPONSE_CACHE['ALIAS']]
+
+
+def version_key(scope, id):
+    return 'farhood:version:{}:{}'.format(scope, id)
+
+
+def get_versions(scopes):
+    """
+    Current version token of each (scope, id), e.g. ('user', 1) or ('event', 7).
+
+    Tokens are random, so a version evicted from the cache can never be recreated
+    with the value an older entry was stored under.
+    """
+    cache = get_response_cache()
+    keys = [version_key(scope, id) for scope, id in scopes]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    for key in missing:
+        cache.add(key, uuid.uuid4().hex, None)
+    if missing:
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, '') for key in keys]
+
+
+def bump_versions(scopes):
+    if scopes:
+        get_response_cache().set_many({version_key(scope, id): uuid.uuid4().hex for scope, id in set(scopes)}, None)
+
+
+def read_through(kind, scopes, parts, compute):
+    """
+    Return the cached result of ``compute`` while none of ``scopes`` has been bumped.
+
+    :param kind: name of the cached resource, also used for the hit/miss counters
+    :param scopes: list of (scope, id) the result depends on
+    :param parts: request specific values that change the result, e.g. a cursor
+    :param compute: function building the result from the database
+    """
+    cache = get_response_cache()
+    raw_key = '|'.join([kind] + get_versions(scopes) + [str(part) for part in parts])
+    key = 'farhood:{}:{}'.format(kind, hashlib.md5(raw_key.encode('utf-8')).hexdigest())
+    cached = cache.get(key)
+    with cache_stats_lock:
+        cache_stats[kind]['hits' if cached is not None else 'misses'] += 1
+    if cached is not None:
+        return cached[0]
+    data = compute()
+    cache.set(key, (data,), settings.RESPONSE_CACHE['TIMEOUT'])
+    return data
+
+
+def get_cache_stats():
+    with cache_stats_lock:
+        return {kind: dict(counter) for kind, counter in cache_stats.items()}
+
+
+def request_base(request):
+    # Serialized image URLs are absolute, so entries are kept per host.
+    return request.build_absolute_uri('/') if request is not None else ''
+
+
+def etag(request, stamp):
+    """
+    ETag of a response to ``request`` built from the database version ``stamp``.
+
+    The full URL and the user are part of it, so cursors, field selections and hosts
+    never share a tag. The stamp is kept as ``request.etag_stamp`` for the view to pass
+    on to the read-through cache, so a cached body is only served under the tag of the
+    database state it was built from, whichever process invalidated the cache.
+    """
+    request.etag_stamp = stamp
+    raw = '|'.join([request.build_absolute_uri(), str(request.user.id), str(stamp)])
+    return hashlib.md5(raw.encode('utf-8')).hexdigest()
+
+
+def profile_etag(request):
+    # Counters are bumped with update(), which leaves updated_at alone.
+    stamp = User.objects.filter(id=request.user.id).values_list('updated_at', *User.COUNTER_FIELDS).first()
+    return etag(request, stamp)
+
+
+def friends_etag(request):
+    # friends_version is bumped whenever a friend, a friend's latest event or its members change.
+    return etag(request, User.objects.filter(id=request.user.id).values_list('friends_version', flat=True).first())
+
+
+def user_event_etag(request):
+    stamp = (Event.objects.filter(user_id=request.user.id).order_by('-created_at')
+             .values_list('id', 'version', 'updated_at', 'user__updated_at').first())
+    return etag(request, stamp)
+
+
+def follower_ids(user_ids):
+    """Users whose friends list contains one of ``user_ids``."""
+    through = User.ref_user.through
+    followers = set()
+    for batch in chunked(user_ids, QUERY_BATCH_SIZE):
+        followers.update(through.objects.filter(to_user_id__in=batch).values_list('from_user_id', flat=True))
+    return followers
+
+
+def invalidate_users(user_ids):
+    """Profile, image, latest event and the friends lists showing these users."""
+    scopes = [('user', user_id) for user_id in user_ids]
+    scopes += [('friends', follower_id) for follower_id in follower_ids(user_ids)]
+    bump_versions(scopes)
+
+
+def invalidate_event(event_id, owner_id=None):
+    bump_versions([('event', event_id)])
+    if owner_id:
+        invalidate_users([owner_id])
+
+
+def invalidate_friendships(user_ids):
+    """Friends lists and counters of users whose ref_user rows changed."""
+    bump_versions([('friends', user_id) for user_id in user_ids])
+    invalidate_users(user_ids)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance=None, **kwargs):
+    # Members and commenters are shown by name in event details.
+    event_ids = set(EventMember.objects.filter(user_id=instance.id).values_list('event_id', flat=True))
+    event_ids.update(Comment.objects.filter(user_id=instance.id).values_list('event_id', flat=True))
+    bump_versions([('event', event_id) for event_id in event_ids])
+    invalidate_users([instance.id])
+
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def invalidate_event_cache(sender, instance=None, **kwargs):
+    invalidate_event(instance.id, instance.user_id)
+
+
+@receiver(post_save, sender=EventMember)
+@receiver(post_delete, sender=EventMember)
+def invalidate_event_member_cache(sender, instance=None, **kwargs):
+    owner_id = Event.objects.filter(id=instance.event_id).values_list('user_id', flat=True).first()
+    invalidate_event(instance.event_id, owner_id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=EventReaction)
+@receiver(post_delete, sender=EventReaction)
+def invalidate_event_activity_cache(sender, instance=None, **kwargs):
+    invalidate_event(instance.event_id)
 
-def get_user_event(user_id):
-    events = Event.objects.filter(user_id=user_id).order_by('-created_at').first()
-    result = UserEventSerializer(events, many=False)
-    return result.data
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def publish_comment(sender, instance=None, created=False, **kwargs):
+    action = 'deleted' if kwargs['signal'] is post_delete else 'created' if created else 'updated'
+    publish_event_activity(instance.event_id, 'comment', action, CommentThreadSerializer(instance).data)
+
+
+@receiver(post_save, sender=EventReaction)
+@receiver(post_delete, sender=EventReaction)
+def publish_reaction(sender, instance=None, created=False, **kwargs):
+    action = 'deleted' if kwargs['signal'] is post_delete else 'created' if created else 'updated'
+    publish_event_activity(instance.event_id, 'reaction', action, EventReactionSerializer(instance).data)
+
+
+@receiver(post_save, sender=EventMember)
+@receiver(post_delete, sender=EventMember)
+def publish_member(sender, instance=None, created=False, **kwargs):
+    action = 'deleted' if kwargs['signal'] is post_delete else 'created' if created else 'updated'
+    publish_event_activity(instance.event_id, 'member', action, FollowEventMemberSerializer(instance).data)
+
+
+@receiver(m2m_changed, sender=User.ref_user.through)
+def invalidate_friendship_cache(sender, instance=None, action=None, pk_set=None, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        user_ids = set(pk_set or getattr(instance, '_cleared_friend_ids', ()))
+        user_ids.add(instance.pk)
+        invalidate_friendships(user_ids)
+
+
+def paginate(queryset, paginator, ordering):
+    if paginator is None:
+        return queryset
+    return paginator.paginate_queryset(queryset, ordering)
+
+
+def friends_of(user_id):
+    friend_ids = User.ref_user.through.objects.filter(from_user_id=user_id).values('to_user_id')
+    return User.objects.filter(id__in=friend_ids)
+
+
+def with_latest_event_id(ref_users):
+    latest_event = Event.objects.filter(user_id=OuterRef('pk')).order_by('-id').values('id')[:1]
+    return ref_users.annotate(latest_event_id=Subquery(latest_event))
+
+
+def get_user_event(user_id, selection=None, stamp=None):
+    def get_latest_event_id():
+        return Event.objects.filter(user_id=user_id).order_by('-created_at').values_list('id', flat=True).first()
+
+    def compute():
+        def selects(name):
+            return UserEventSerializer.selects(selection, name)
+
+        events = Event.objects.filter(id=event_id).select_related('user')
+        if selects('comments_count'):
+            events = events.annotate(comments_count=Count('comment'))
+        if selects('event_member'):
+            events = events.prefetch_related(
+                Prefetch('eventmember_set', queryset=EventMember.objects.filter(follow=True).select_related('user'),
+                         to_attr='followed_members'))
+        if selects('reaction'):
+            events = events.prefetch_related(
+                Prefetch('eventreaction_set', queryset=EventReaction.objects.order_by('id'),
+                         to_attr='ordered_reactions'))
+        events = events.first() if event_id else None
+        if events is not None and selects('comments'):
+            # Prefetch cannot be sliced, a single event needs one query anyway.
+            events.latest_comments = list(Comment.objects.filter(event_id=event_id).select_related('user')
+                                          .order_by('-created_at', '-id')[:settings.EVENT_DETAIL_COMMENTS])
+        result = UserEventSerializer(events, many=False, selection=selection)
+        return result.data
+
+    event_id = read_through('latest_event', [('user', user_id)], [stamp], get_latest_event_id)
+    parts = [selection.cache_key() if selection else '', stamp]
+    return read_through('user_event', [('user', user_id), ('event', event_id)], parts, compute)
 
 
 def get_user_image_url(id, request=None):
-    user_image = User.objects.get(id=id)
-    result = UserImageSerializer(user_image, context={'request': request}, many=False)
-    return result.data
+    def compute():
+        user_image = User.objects.get(id=id)
+        result = UserImageSerializer(user_image, context={'request': request}, many=False)
+        return result.data
 
+    return read_through('image', [('user', id)], [request_base(request)], compute)
 
-def get_user_profile(id, request=None):
-    users = User.objects.filter(id=id).first()
-    result = UserProfileSerializer(users, context={'request': request}, many=False)
-    return result.data
 
+def get_user_profile(id, request=None, stamp=None):
+    def compute():
+        users = User.objects.filter(id=id).first()
+        result = UserProfileSerializer(users, context={'request': request}, many=False)
+        return result.data
+
+    return read_through('profile', [('user', id)], [request_base(request), stamp], compute)
 
-def get_event_comments(event_id, user_id):
-    comments = Comment.objects.filter(event_id=event_id, user_id=user_id)
-    result = EventCommentSerializer(comments, many=True)
-    return result.data
+
+def get_event_comments(event_id, user_id, paginator=None):
+    comments = comment_values(Comment.objects.filter(event_id=event_id, user_id=user_id))
+    comments = paginate(comments, paginator, ('-created_at', '-id'))
+    return serialize_comments(comments)
+
+
+def get_comment_thread(event_id, paginator):
+    """All comments of an event newest first, one keyset page at a time."""
+    def compute():
+        comments = Comment.objects.filter(event_id=event_id).select_related('user')
+        comments = paginator.paginate_queryset(comments, ('-created_at', '-id'))
+        result = CommentThreadSerializer(comments, many=True)
+        return result.data, paginator.next_cursor, paginator.previous_cursor
+
+    data, paginator.next_cursor, paginator.previous_cursor = read_through(
+        'comments', [('event', event_id)], [paginator.get_cache_key()], compute)
+    return data
 
 
 def get_event_actions(event_id, user_id):
@@ -42,27 +305,123 @@ def remove_event_member(event_id, user_id):
     return 'successfully unfollowed'
 
 
-def get_follow_events(follow, user_id):
-    follow_events = EventMember.objects.filter(follow=follow, user_id=user_id)
-    result = EventMemberFriendSerializer(follow_events, many=True)
-    return result.data
+def get_follow_events(follow, user_id, paginator=None):
+    follow_events = event_member_values(EventMember.objects.filter(follow=follow, user_id=user_id))
+    follow_events = paginate(follow_events, paginator, ('-id',))
+    return serialize_event_members(follow_events)
 
 
-def get_unfollow_events(follow, user_id):
-    unfollow_events = EventMember.objects.filter(follow=follow, user_id=user_id)
-    result = EventMemberFriendSerializer(unfollow_events, many=True)
-    return result.data
+def get_unfollow_events(follow, user_id, paginator=None):
+    unfollow_events = event_member_values(EventMember.objects.filter(follow=follow, user_id=user_id))
+    unfollow_events = paginate(unfollow_events, paginator, ('-id',))
+    return serialize_event_members(unfollow_events)
 
 
-def get_friends_list(id):
-    friends = User.objects.filter(id=id).first()
-    ref_users = friends.ref_user.filter(temporary_profile=False)
-    result = FriendsEventSerializer(ref_users, many=False)
-    return result.data
+def get_friends_list(id, paginator=None, stamp=None):
+    def compute():
+        ref_users = friend_values(with_latest_event_id(friends_of(id).filter(temporary_profile=False)))
+        data = {'ref_users': serialize_friends(list(paginate(ref_users, paginator, ('id',))))}
+        if paginator is None:
+            return data, None, None
+        return data, paginator.next_cursor, paginator.previous_cursor
 
+    page = paginator.get_cache_key() if paginator is not None else ''
+    data, next_cursor, previous_cursor = read_through('friends', [('friends', id)], [page, stamp], compute)
+    if paginator is not None:
+        paginator.next_cursor, paginator.previous_cursor = next_cursor, previous_cursor
+    return data
 
-def get_contacts_list(id):
-    contacts = User.objects.filter(id=id).first()
-    ref_users = contacts.ref_user.all()
-    result = FriendsEventSerializer(ref_users, many=False)
-    return result.data
+
+def get_contacts_list(id, paginator=None):
+    ref_users = friend_values(with_latest_event_id(friends_of(id)))
+    return {'ref_users': serialize_friends(list(paginate(ref_users, paginator, ('id',))))}
+
+
+FEED_ORDERINGS = {
+    'recent': ('-created_at', '-id'),
+    'upcoming': ('scheduled_time', 'id'),
+}
+
+
+def get_friends_feed(user_id, order='recent', paginator=None, selection=None):
+    """
+    Events created by the user's friends, newest first, or soonest first for ``upcoming``.
+
+    Friend ids stay a subquery, so the database walks the (user, created_at) or
+    (user, scheduled_time) index of each friend instead of Python building an IN list.
+    With settings.FEED['FANOUT'] the recent feed reads the user's FeedEntry inbox
+    instead, merged with the events of friends too popular to be fanned out.
+    """
+    def compute():
+        friend_ids = User.ref_user.through.objects.filter(from_user_id=user_id).values('to_user_id')
+        if order == 'recent' and settings.FEED['FANOUT']:
+            events = get_inbox_events(user_id, friend_ids, paginator, selection)
+        else:
+            events = Event.objects.filter(user_id__in=friend_ids)
+            if order == 'upcoming':
+                events = events.filter(scheduled_time__gte=timezone.now())
+            events = paginate(event_values(events, selection), paginator, FEED_ORDERINGS[order])
+        data = serialize_events(list(events), selection)
+        if paginator is None:
+            return data, None, None
+        return data, paginator.next_cursor, paginator.previous_cursor
+
+    page = paginator.get_cache_key() if paginator is not None else ''
+    parts = [order, page, selection.cache_key() if selection else '']
+    data, next_cursor, previous_cursor = read_through('feed', [('friends', user_id)], parts, compute)
+    if paginator is not None:
+        paginator.next_cursor, paginator.previous_cursor = next_cursor, previous_cursor
+    return data
+
+
+def get_inbox_events(user_id, friend_ids, paginator=None, selection=None):
+    entries = FeedEntry.objects.filter(owner_id=user_id).values('event_id', 'created_at')
+    popular_ids = friend_ids.filter(to_user__friends_count__gt=settings.FEED['FANOUT_MAX_FOLLOWERS'])
+    pulled = Event.objects.filter(user_id__in=popular_ids).values('id', 'created_at')
+    if paginator is None:
+        events = Event.objects.filter(Q(id__in=entries.values('event_id')) | Q(id__in=pulled.values('id')))
+        return event_values(events, selection).order_by(*FEED_ORDERINGS['recent'])
+    page = paginator.paginate_querysets([(entries, ('-created_at', '-event_id')), (pulled, FEED_ORDERINGS['recent'])])
+    event_ids = [item['event_id'] if 'event_id' in item else item['id'] for item in page]
+    events = {row['id']: row for row in event_values(Event.objects.filter(id__in=event_ids), selection)}
+    return [events[event_id] for event_id in event_ids if event_id in events]
+
+
+def get_nearby_events(latitude, longitude, radius, event_type=None, start=None, end=None, paginator=None,
+                      selection=None):
+    """
+    Events within ``radius`` km of a point, nearest first.
+
+    Candidates come from index range scans over the geohash cells covering the circle,
+    narrowed by a latitude/longitude bounding box; exact distances are then computed
+    with the haversine formula and only the requested page is loaded and serialized.
+    """
+    cells = Q()
+    for cell in covering_cells(latitude, longitude, radius):
+        cells |= Q(geohash__gte=cell, geohash__lt=cell + '{')
+    delta_lat, delta_lon = bounding_box(latitude, longitude, radius)
+    candidates = Event.objects.filter(cells, latitude__range=(latitude - delta_lat, latitude + delta_lat))
+    if -180.0 <= longitude - delta_lon and longitude + delta_lon <= 180.0:
+        candidates = candidates.filter(longitude__range=(longitude - delta_lon, longitude + delta_lon))
+    if event_type:
+        candidates = candidates.filter(event_type=event_type)
+    if start:
+        candidates = candidates.filter(scheduled_time__gte=start)
+    if end:
+        candidates = candidates.filter(scheduled_time__lte=end)
+
+    nearby = []
+    for event_id, event_latitude, event_longitude in candidates.values_list('id', 'latitude', 'longitude'):
+        distance = haversine(latitude, longitude, event_latitude, event_longitude)
+        if distance <= radius:
+            nearby.append((round(distance, 3), event_id))
+    nearby.sort()
+    if paginator is not None:
+        nearby = paginator.paginate_sequence(nearby, key=lambda item: item, types=(float, int))
+
+    events = event_values(Event.objects.filter(id__in=[event_id for _, event_id in nearby]), selection)
+    events = {row['id']: row for row in events}
+    result = serialize_events([events[event_id] for _, event_id in nearby], selection)
+    for data, (distance, _) in zip(result, nearby):
+        data['distance'] = distance
+    return result
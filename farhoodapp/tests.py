@@ -1,3 +1,478 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from farhoodapp.benchmark import api_patterns, build_routes, check_budgets, load_budgets, run_benchmark, seed_dataset
+from farhoodapp.dataset import DatasetGenerator
+from farhoodapp.middleware import fingerprint, query_stats
+from farhoodapp.models import Comment, Event, EventMember, EventReaction, User
+from farhoodapp.pubsub import CacheBroker
+from farhoodapp.rows import (comment_values, event_member_values, event_values, friend_values, serialize_comments,
+                             serialize_event_members, serialize_events, serialize_friends)
+from farhoodapp.serializers import (EventCommentSerializer, EventMemberFriendSerializer, EventSerializer,
+                                    FieldSelection, FriendsEventSerializer)
+from farhoodapp.services import friends_of, get_response_cache, with_latest_event_id
+from farhoodapp.upsert import insert_ignore, supports_upsert, upsert
+from farhoodapp.utils import CustomResponse
+
+
+TEST_CACHES = dict(settings.CACHES, **{settings.RESPONSE_CACHE['ALIAS']: {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'farhood-tests',
+}})
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CacheIsolatedTestCase(TestCase):
+    """
+    Tests run on their own in-memory response cache, started empty: the configured one is
+    shared with any server running from the same checkout.
+    """
+
+    def setUp(self):
+        get_response_cache().clear()
+
+
+def render(data):
+    return JSONRenderer().render(CustomResponse.create_response(True, status.HTTP_200_OK, "Success", data).data)
+
+
+class RowSerializerParityTest(CacheIsolatedTestCase):
+    """The ``.values()`` serializers of farhoodapp.rows render the same bytes as the DRF serializers."""
+
+    def setUp(self):
+        super(RowSerializerParityTest, self).setUp()
+        self.user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner',
+                                        last_name='One', phone_number='+15550000001')
+        self.friend = User.objects.create(email='friend@example.com', username='friend', first_name='Friend')
+        self.quiet = User.objects.create(email='quiet@example.com', username='quiet', first_name='Quiet',
+                                         phone_number='+15550000003')
+        self.user.ref_user.add(self.friend, self.quiet)
+        scheduled = timezone.now().replace(microsecond=123456) + datetime.timedelta(days=2)
+        self.events = [
+            Event.objects.create(user=self.user, name='Coffee', description='Beans', location_name='Cafe',
+                                 location_address='1 Main St', latitude=52, longitude=-0.5, scheduled_time=scheduled),
+            Event.objects.create(user=self.friend, name='Lunch', event_type='lunch', description='',
+                                 location_name='', location_address='', latitude=None, longitude=None),
+            Event.objects.create(user=self.friend, name='Dinner', event_type='dinner', description='Late',
+                                 location_name='Home', location_address='2 Side St', latitude=48.8566,
+                                 longitude=2.3522),
+        ]
+        EventMember.objects.create(event=self.events[0], user=self.friend, follow=True)
+        EventMember.objects.create(event=self.events[0], user=self.quiet, follow=False)
+        EventMember.objects.create(event=self.events[2], user=self.user, follow=True)
+        Comment.objects.create(event=self.events[0], user=self.friend, message='See you there')
+        Comment.objects.create(event=self.events[0], user=self.friend, message=u'☕ at 9')
+
+    def assertParity(self, expected, actual):
+        self.assertEqual(render(expected), render(actual))
+
+    def test_events(self):
+        events = Event.objects.order_by('-created_at', '-id')
+        self.assertParity(EventSerializer(events, many=True).data, serialize_events(list(event_values(events))))
+
+    def test_event_selections(self):
+        events = Event.objects.order_by('id')
+        for selection in (FieldSelection(fields={'id', 'name', 'scheduled_time'}), FieldSelection(expand=set()),
+                          FieldSelection(fields={'id'}, expand={'members'}), FieldSelection(fields=set())):
+            self.assertParity(EventSerializer(events, many=True, selection=selection).data,
+                              serialize_events(list(event_values(events, selection)), selection))
+
+    def test_friends(self):
+        for user in (self.user, self.friend, self.quiet):
+            friends = with_latest_event_id(friends_of(user.id)).order_by('id')
+            self.assertParity(FriendsEventSerializer(list(friends), many=False).data,
+                              {'ref_users': serialize_friends(list(friend_values(friends)))})
+
+    def test_event_members(self):
+        for follow in (True, False):
+            members = EventMember.objects.filter(follow=follow).order_by('-id')
+            self.assertParity(EventMemberFriendSerializer(members, many=True).data,
+                              serialize_event_members(list(event_member_values(members))))
+
+    def test_comments(self):
+        comments = Comment.objects.order_by('-created_at', '-id')
+        self.assertParity(EventCommentSerializer(comments, many=True).data,
+                          serialize_comments(list(comment_values(comments))))
+
+    def test_friends_view(self):
+        token = Token.objects.get(user=self.user)
+        response = self.client.get('/farhood/get/contacts/', HTTP_AUTHORIZATION='Token {}'.format(token.key))
+        friends = with_latest_event_id(friends_of(self.user.id)).order_by('id')
+        expected = CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
+                                                  FriendsEventSerializer(list(friends), many=False).data).data
+        expected['next'] = None
+        expected['previous'] = None
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+
+def cursor(position, reverse=0):
+    return base64.urlsafe_b64encode(json.dumps({'p': position, 'r': reverse}).encode('utf-8')).decode('ascii')
+
+
+class CursorValidationTest(CacheIsolatedTestCase):
+    """Malformed cursors are answered with 404 'Invalid cursor', never reach the ORM."""
+
+    def setUp(self):
+        super(CursorValidationTest, self).setUp()
+        self.user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        self.friends = [User.objects.create(email='friend{}@example.com'.format(index),
+                                            username='friend{}'.format(index), first_name='Friend')
+                        for index in range(3)]
+        self.user.ref_user.add(*self.friends)
+        self.event = Event.objects.create(user=self.user, name='Coffee')
+        for index in range(3):
+            Comment.objects.create(event=self.event, user=self.friends[index], message='Comment {}'.format(index))
+        self.auth = 'Token {}'.format(Token.objects.get(user=self.user).key)
+
+    def get(self, path, **params):
+        return self.client.get(path, params, HTTP_AUTHORIZATION=self.auth)
+
+    def test_invalid_cursors(self):
+        for path, name, position in (
+                ('/farhood/get/friends/', 'cursor', [{'a': 1}]),
+                ('/farhood/get/friends/', 'cursor', ['x']),
+                ('/farhood/get/friends/', 'cursor', [1, 2]),
+                ('/farhood/get/friends/', 'cursor', [None]),
+                ('/farhood/event/comments/', 'before', ['not a date', 1]),
+                ('/farhood/event/comments/', 'after', [1]),
+                ('/farhood/event/comments/', 'before', [['2017-01-01T00:00:00+00:00'], 1])):
+            response = self.get(path, event_id=self.event.id, **{name: cursor(position)})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, (path, position))
+        self.assertEqual(self.get('/farhood/get/friends/', cursor='%%%').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_nearby_cursors(self):
+        Event.objects.create(user=self.user, name='Park', latitude=40.01, longitude=-74.01)
+        for position in (['x', 1], [1.5, '2'], [[1], 2], [1.5], [True, 2], [None, 2]):
+            response = self.get('/farhood/events/nearby/', latitude=40, longitude=-74, radius=25,
+                                cursor=cursor(position))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+        response = self.get('/farhood/events/nearby/', latitude=40, longitude=-74, radius=25, cursor=cursor([0, 0]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cursor_round_trip(self):
+        seen = []
+        response = self.get('/farhood/get/contacts/', page_size=1)
+        while True:
+            data = json.loads(response.content.decode('utf-8'))
+            seen.extend(friend['user_id'] for friend in data['data']['ref_users'])
+            if not data['next']:
+                break
+            response = self.get('/farhood/get/contacts/', page_size=1, cursor=data['next'])
+        self.assertEqual(seen, [friend.id for friend in self.friends])
+
+        newest = self.get('/farhood/event/comments/', event_id=self.event.id, page_size=2)
+        older = self.get('/farhood/event/comments/', event_id=self.event.id, page_size=2,
+                         before=json.loads(newest.content.decode('utf-8'))['before'])
+        self.assertEqual(len(json.loads(older.content.decode('utf-8'))['data']), 1)
+
+
+class ProfileUpdateTest(CacheIsolatedTestCase):
+    """Profile writes never put back stale values of columns changed by other processes."""
+
+    def test_keeps_changes_from_other_processes(self):
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        auth = 'Token {}'.format(Token.objects.get(user=user).key)
+        self.assertEqual(self.client.get('/farhood/get/profile/', HTTP_AUTHORIZATION=auth).status_code,
+                         status.HTTP_200_OK)
+        # Written elsewhere without signals, so the token cache still holds the old row.
+        User.objects.filter(id=user.id).update(thumbnails_ready=True, password='changed', address='Elsewhere')
+        response = self.client.put('/farhood/profile/', json.dumps({'first_name': 'Renamed'}),
+                                   content_type='application/json', HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.thumbnails_ready, user.password, user.address),
+                         ('Renamed', True, 'changed', 'Elsewhere'))
+
+    def test_full_save_writes_counters(self):
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        user.friends_count = 7
+        user.save()
+        user.refresh_from_db()
+        self.assertEqual(user.friends_count, 7)
+
+    def test_full_save_writes_thumbnails_ready(self):
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        user.thumbnails_ready = True
+        user.save()
+        user.refresh_from_db()
+        self.assertTrue(user.thumbnails_ready)
+
+
+class EventCreateTest(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super(EventCreateTest, self).setUp()
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        self.auth = 'Token {}'.format(Token.objects.get(user=user).key)
+
+    def create(self, users):
+        payload = {'name': 'Coffee', 'description': 'Beans', 'location_name': 'Cafe', 'location_address': '1 Main St',
+                   'users': users}
+        response = self.client.post('/farhood/event/create/', json.dumps(payload), content_type='application/json',
+                                    HTTP_AUTHORIZATION=self.auth)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_rejects_invitees_that_are_not_a_list_of_objects(self):
+        for users in ('abc', {'email': 'friend@example.com'}, ['friend@example.com'], [1]):
+            self.assertEqual(self.create(users)['message'], 'users must be a list of objects')
+        self.assertFalse(Event.objects.exists())
+        self.assertEqual(len(self.create([{'email': 'friend@example.com'}])['data']['invitations']), 1)
+
+
+class BatchHeadersTest(CacheIsolatedTestCase):
+
+    def test_conditional_headers_are_per_request(self):
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        auth = 'Token {}'.format(Token.objects.get(user=user).key)
+        etag = self.client.get('/farhood/get/profile/', HTTP_AUTHORIZATION=auth)['ETag']
+
+        def batch(item, **headers):
+            response = self.client.post('/farhood/batch/', json.dumps({'requests': [item]}),
+                                        content_type='application/json', HTTP_AUTHORIZATION=auth, **headers)
+            return json.loads(response.content.decode('utf-8'))['data'][0]
+
+        result = batch({'path': '/farhood/get/profile/'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((result['status'], result['etag']), (status.HTTP_200_OK, etag))
+        result = batch({'path': '/farhood/get/profile/', 'headers': {'If-None-Match': etag}})
+        self.assertEqual(result['status'], status.HTTP_304_NOT_MODIFIED)
+
+    def test_only_api_paths(self):
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        auth = 'Token {}'.format(Token.objects.get(user=user).key)
+        items = [{'path': path} for path in ('/farhood/get/profile/', '/admin/', '/login/')]
+        response = self.client.post('/farhood/batch/', json.dumps({'requests': items}),
+                                    content_type='application/json', HTTP_AUTHORIZATION=auth)
+        results = json.loads(response.content.decode('utf-8'))['data']
+        self.assertEqual([result['status'] for result in results],
+                         [status.HTTP_200_OK, status.HTTP_404_NOT_FOUND, status.HTTP_404_NOT_FOUND])
+
+
+class ConditionalGetTest(CacheIsolatedTestCase):
+    """A cached body is never served under the ETag of a newer database state."""
+
+    def test_write_from_another_process(self):
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        friend = User.objects.create(email='friend@example.com', username='friend', first_name='Friend',
+                                     temporary_profile=False)
+        user.ref_user.add(friend)
+        auth = 'Token {}'.format(Token.objects.get(user=user).key)
+        for path in ('/farhood/get/profile/', '/farhood/get/friends/'):
+            self.client.get(path, HTTP_AUTHORIZATION=auth)
+        # Written without signals, as a job process invalidating only its own cache would leave it.
+        User.objects.filter(id=user.id).update(first_name='Renamed', updated_at=timezone.now())
+        User.objects.filter(id=friend.id).update(first_name='Friendly')
+        User.objects.filter(id=user.id).update(friends_version=F('friends_version') + 1)
+
+        profile = json.loads(self.client.get('/farhood/get/profile/', HTTP_AUTHORIZATION=auth).content.decode('utf-8'))
+        self.assertEqual(profile['data']['name'], 'Renamed ')
+        friends = json.loads(self.client.get('/farhood/get/friends/', HTTP_AUTHORIZATION=auth).content.decode('utf-8'))
+        self.assertEqual([friend['name'] for friend in friends['data']['ref_users']], ['Friendly'])
+
+
+class DatasetGeneratorTest(CacheIsolatedTestCase):
+
+    def test_runs_append(self):
+        for _ in range(2):
+            written = DatasetGenerator(20, tokens=20).generate(chunk_size=8)
+            self.assertEqual((written['users'], written['tokens']), (20, 20))
+        self.assertEqual(Token.objects.filter(user__email__endswith='@dataset.example.com').count(), 40)
+
+
+class MalformedInputTest(CacheIsolatedTestCase):
+    """Malformed ids and bodies get the endpoint's error envelope, never a 500."""
+
+    def setUp(self):
+        super(MalformedInputTest, self).setUp()
+        self.user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        self.auth = 'Token {}'.format(Token.objects.get(user=self.user).key)
+
+    def envelope(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = json.loads(response.content.decode('utf-8'))
+        return data['code'], data['message']
+
+    def test_job_id(self):
+        for params in ({'job_id': 'abc'}, {}):
+            response = self.client.get('/farhood/job/', params, HTTP_AUTHORIZATION=self.auth)
+            self.assertEqual(self.envelope(response), (status.HTTP_404_NOT_FOUND, 'Job not found'))
+
+    def test_invitation_event_id(self):
+        for event in ('abc', None, [1]):
+            payload = {'event': event, 'users': [{'email': 'friend@example.com'}]}
+            response = self.client.post('/farhood/add/member/', json.dumps(payload), content_type='application/json',
+                                        HTTP_AUTHORIZATION=self.auth)
+            self.assertEqual(self.envelope(response), (status.HTTP_404_NOT_FOUND, 'Event not found'), event)
+
+    def test_batch_body(self):
+        for body in ([{'path': '/farhood/get/profile/'}], 'requests', 1):
+            response = self.client.post('/farhood/batch/', json.dumps(body), content_type='application/json',
+                                        HTTP_AUTHORIZATION=self.auth)
+            self.assertEqual(self.envelope(response), (status.HTTP_400_BAD_REQUEST, 'Body must be a JSON object'))
+
+
+class UpsertTest(CacheIsolatedTestCase):
+    """insert_ignore and upsert on the native ON CONFLICT path and on the fallback for older databases."""
+
+    def setUp(self):
+        super(UpsertTest, self).setUp()
+        self.owner = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        self.user = User.objects.create(email='friend@example.com', username='friend', first_name='Friend')
+        self.event = Event.objects.create(user=self.owner, name='Coffee')
+        self.key = {'event_id': self.event.id, 'user_id': self.user.id}
+
+    def both_paths(self, check):
+        self.assertTrue(supports_upsert())
+        with self.subTest(path='on conflict'):
+            with transaction.atomic():
+                check()
+                transaction.set_rollback(True)
+        with self.subTest(path='fallback'), mock.patch('farhoodapp.upsert.supports_upsert', return_value=False):
+            with transaction.atomic():
+                check()
+                transaction.set_rollback(True)
+
+    def test_insert_ignore(self):
+        def check():
+            member = insert_ignore(EventMember, dict(self.key, follow=False), ('event', 'user'))
+            self.assertEqual(EventMember.objects.get(**self.key).id, member.id)
+            self.assertIsNone(insert_ignore(EventMember, dict(self.key, follow=True), ('event', 'user')))
+            self.assertEqual(list(EventMember.objects.filter(**self.key).values_list('follow', flat=True)), [False])
+            self.owner.refresh_from_db()
+            self.assertEqual(self.owner.participants_count, 1)
+        self.both_paths(check)
+
+    def test_upsert(self):
+        def check():
+            member, created = upsert(EventMember, self.key, {'follow': False})
+            self.assertTrue(created)
+            updated, created = upsert(EventMember, self.key, {'follow': True})
+            self.assertFalse(created)
+            self.assertEqual(updated.id, member.id)
+            self.assertEqual(list(EventMember.objects.filter(**self.key).values_list('follow', flat=True)), [True])
+            self.owner.refresh_from_db()
+            self.assertEqual(self.owner.participants_count, 1)
+        self.both_paths(check)
+
+    def test_guard(self):
+        def check():
+            missing = Event.objects.filter(id=self.event.id + 1)
+            key = {'event_id': self.event.id + 1, 'user_id': self.user.id}
+            self.assertIsNone(insert_ignore(EventMember, dict(key, follow=False), ('event', 'user'), guard=missing))
+            self.assertEqual(upsert(EventMember, key, {'follow': True}, guard=missing), (None, False))
+            self.assertFalse(EventMember.objects.exists())
+            # The guard only stops inserts, an existing row is still updated.
+            guard = Event.objects.filter(id=self.event.id)
+            upsert(EventMember, self.key, {'follow': False}, guard=guard)
+            self.assertEqual(upsert(EventMember, self.key, {'follow': True}, guard=guard)[1], False)
+        self.both_paths(check)
+
+    def test_member_views(self):
+        auth = 'Token {}'.format(Token.objects.get(user=self.user).key)
+
+        def post(path, event_id):
+            response = self.client.post(path, {'event': event_id}, HTTP_AUTHORIZATION=auth)
+            data = json.loads(response.content.decode('utf-8'))
+            return data.get('message') or data.get('error')
+
+        for path in ('/farhood/unfollow/member/', '/farhood/add/member/'):
+            EventMember.objects.all().delete()
+            self.assertEqual(post(path, self.event.id + 1), 'Event not found')
+            self.assertEqual(post(path, self.event.id), 'Success')
+            self.assertEqual(post(path, self.event.id), 'Member Already Exists')
+
+
+class DuplicateMembersMigrationTest(TransactionTestCase):
+    """Migration 0023 keeps the latest of duplicate memberships and reactions before making them unique."""
+
+    def test_remove_duplicates(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('farhoodapp', '0022_job')])
+        apps = executor.loader.project_state([('farhoodapp', '0022_job')]).apps
+        owner = apps.get_model('farhoodapp', 'User').objects.create(email='owner@example.com', username='owner')
+        event = apps.get_model('farhoodapp', 'Event').objects.create(user=owner, name='Coffee')
+        for follow in (False, True):
+            apps.get_model('farhoodapp', 'EventMember').objects.create(event=event, user=owner, follow=follow)
+            apps.get_model('farhoodapp', 'EventReaction').objects.create(event=event, user=owner, reaction=follow)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        self.assertEqual(list(EventMember.objects.values_list('follow', flat=True)), [True])
+        self.assertEqual(list(EventReaction.objects.values_list('reaction', flat=True)), [True])
+        self.assertEqual(User.objects.get(id=owner.id).participants_count, 1)
+
+
+class CacheBrokerTest(CacheIsolatedTestCase):
+
+    def setUp(self):
+        super(CacheBrokerTest, self).setUp()
+        self.broker = CacheBroker(poll_interval=0.01)
+        self.broker.cache.clear()
+
+    def test_counter_never_expires(self):
+        with mock.patch.object(self.broker.cache, 'add', wraps=self.broker.cache.add) as add:
+            self.broker.publish('broker-test', {'n': 1})
+        add.assert_called_once_with(self.broker.counter_key('broker-test'), 0, None)
+
+    def test_reader_ahead_of_a_restarted_counter(self):
+        for n in range(3):
+            self.broker.publish('broker-test', {'n': n})
+        self.assertEqual([message_id for message_id, _ in self.broker.read('broker-test', 1, 0)], [2, 3])
+        self.broker.cache.delete(self.broker.counter_key('broker-test'))
+        self.broker.publish('broker-test', {'n': 'after restart'})
+        self.assertEqual(self.broker.read('broker-test', 3, 0), [(1, {'n': 'after restart'})])
+
+
+class QueryInstrumentationTest(CacheIsolatedTestCase):
+
+    def test_stats_leave_out_parameters(self):
+        sql = "SELECT id FROM farhoodapp_user WHERE phone_number = '+4915112345678' AND id = 42"
+        stats = query_stats([(3.0, sql), (1.0, sql)])
+        self.assertNotIn('+4915112345678', json.dumps(stats))
+        self.assertEqual(stats['slowest'][0]['fingerprint'], fingerprint(sql))
+
+    def test_headers(self):
+        user = User.objects.create(email='owner@example.com', username='owner', first_name='Owner')
+        auth = 'Token {}'.format(Token.objects.get(user=user).key)
+        options = dict(settings.SQL_INSTRUMENTATION, SAMPLE_RATE=1.0)
+        with self.settings(SQL_INSTRUMENTATION=options):
+            self.assertNotIn('X-DB-Queries', self.client.get('/farhood/get/profile/', HTTP_AUTHORIZATION=auth))
+        with self.settings(SQL_INSTRUMENTATION=dict(options, HEADERS=True)):
+            response = self.client.get('/farhood/get/profile/', HTTP_AUTHORIZATION=auth)
+        self.assertGreater(int(response['X-DB-Queries']), 0)
+
+
+class EndpointBudgetTest(CacheIsolatedTestCase):
+    """
+    Every API route stays within the SQL query budgets of farhoodapp/benchmark_budgets.json;
+    re-record them with ``manage.py benchmark --update-budgets``. Latencies vary with the machine,
+    ``manage.py benchmark --check`` checks them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.budgets = load_budgets()
+        cls.data = seed_dataset(**cls.budgets['dataset'])
+
+    def test_every_route_is_benchmarked(self):
+        self.assertEqual(set(route.pattern for route in build_routes(self.data)), api_patterns())
+        self.assertEqual(set(self.budgets['routes']), api_patterns())
+
+    def test_budgets(self):
+        results = run_benchmark(self.data, repeat=self.budgets['repeat'])
+        self.assertEqual(check_budgets(results, self.budgets, latency=False), [])
+
+    def test_error_statuses_fail(self):
+        result = {'statuses': [status.HTTP_200_OK, status.HTTP_400_BAD_REQUEST], 'queries': 0, 'p95_ms': 0}
+        self.assertEqual(check_budgets({'get/profile/': result}, self.budgets), ['get/profile/ answered 400'])
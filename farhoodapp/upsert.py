@@ -0,0 +1,133 @@
+import sqlite3
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models.signals import post_save
+
+# ON CONFLICT arrived in SQLite 3.24 and RETURNING in 3.35.
+SQLITE_UPSERT_VERSION = (3, 35, 0)
+POSTGRES_UPSERT_VERSION = 90500
+
+
+def supports_upsert():
+    if connection.vendor == 'postgresql':
+        return connection.pg_version >= POSTGRES_UPSERT_VERSION
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= SQLITE_UPSERT_VERSION
+    return False
+
+
+def insert_sql(model, values, conflict, action, guard=None):
+    meta = model._meta
+    qn = connection.ops.quote_name
+    fields = [meta.get_field(name) for name in values]
+    columns = ', '.join(qn(field.column) for field in fields)
+    params = [field.get_db_prep_save(values[name], connection) for name, field in zip(values, fields)]
+    placeholders = ', '.join(['%s'] * len(fields))
+    if guard is None:
+        source = 'VALUES ({})'.format(placeholders)
+    else:
+        guard_sql, guard_params = guard.values('pk').query.sql_with_params()
+        source = 'SELECT {} WHERE EXISTS ({})'.format(placeholders, guard_sql)
+        params.extend(guard_params)
+    target = ', '.join(qn(meta.get_field(name).column) for name in conflict)
+    returning = qn(meta.pk.column)
+    if connection.vendor == 'postgresql':
+        # xmax is only zero on a freshly inserted row version.
+        returning += ', (xmax = 0)'
+    sql = 'INSERT INTO {} ({}) {} ON CONFLICT ({}) {} RETURNING {}'.format(
+        qn(meta.db_table), columns, source, target, action, returning)
+    return sql, params
+
+
+def update_sql(model, lookup, defaults):
+    meta = model._meta
+    qn = connection.ops.quote_name
+
+    def clause(values, separator):
+        fields = [meta.get_field(name) for name in values]
+        sql = separator.join('{} = %s'.format(qn(field.column)) for field in fields)
+        return sql, [field.get_db_prep_save(values[name], connection) for name, field in zip(values, fields)]
+
+    assignments, params = clause(defaults, ', ')
+    where, where_params = clause(lookup, ' AND ')
+    sql = 'UPDATE {} SET {} WHERE {} RETURNING {}'.format(qn(meta.db_table), assignments, where, qn(meta.pk.column))
+    return sql, params + where_params
+
+
+def saved(model, pk, values, created):
+    # The raw statements skip Model.save, so receivers (counters, cache) are notified here.
+    instance = model(pk=pk, **values)
+    instance._state.adding = False
+    post_save.send(sender=model, instance=instance, created=created, update_fields=None, raw=False,
+                   using=connection.alias)
+    return instance
+
+
+def insert_ignore(model, values, conflict, guard=None):
+    """
+    Insert a row unless one with the same ``conflict`` columns exists, in one statement.
+
+    :param model: model with a unique constraint on ``conflict``
+    :param values: column values keyed by attname, e.g. ``{'event_id': 1, 'user_id': 2}``
+    :param conflict: names of the uniquely constrained fields
+    :param guard: queryset that must match a row for the insert to happen, e.g. the referenced event
+    :return: the new instance, or None when the row already existed or the guard matched nothing
+    """
+    if not supports_upsert():
+        if guard is not None and not guard.exists():
+            return None
+        try:
+            with transaction.atomic():
+                return model.objects.create(**values)
+        except IntegrityError:
+            return None
+
+    sql, params = insert_sql(model, values, conflict, 'DO NOTHING', guard)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return saved(model, row[0], values, True) if row else None
+
+
+def upsert(model, lookup, defaults, guard=None):
+    """
+    Insert a row or update the one matching ``lookup``, without a read-then-write race.
+
+    PostgreSQL does both in one statement. SQLite cannot tell an insert from an
+    update in RETURNING, so an existing row costs a second UPDATE statement.
+
+    :param model: model with a unique constraint on the ``lookup`` fields
+    :param lookup: values of the uniquely constrained fields keyed by attname
+    :param defaults: values to insert or overwrite
+    :param guard: queryset that must match a row for an insert to happen
+    :return: ``(instance, created)``, or ``(None, False)`` when the guard matched nothing
+    """
+    values = dict(lookup, **defaults)
+    if not supports_upsert():
+        if guard is not None and not guard.exists():
+            return None, False
+        return model.objects.update_or_create(defaults=defaults, **lookup)
+
+    if connection.vendor == 'postgresql':
+        qn = connection.ops.quote_name
+        assignments = ', '.join('{0} = EXCLUDED.{0}'.format(qn(model._meta.get_field(name).column))
+                                for name in defaults)
+        sql, params = insert_sql(model, values, lookup, 'DO UPDATE SET {}'.format(assignments), guard)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if not row:
+            return None, False
+        return saved(model, row[0], values, row[1]), row[1]
+
+    with transaction.atomic():
+        instance = insert_ignore(model, values, lookup, guard)
+        if instance:
+            return instance, True
+        sql, params = update_sql(model, lookup, defaults)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    if not row:
+        return None, False
+    return saved(model, row[0], values, False), False
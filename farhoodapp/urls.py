@@ -1,16 +1,17 @@
 from django.conf.urls import url
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework.authtoken import views as rest_framework_views
 from farhoodapp.views import (UserCreate, UpdateProfileUser, UserEventView, EventCreateView, EventEditView,
                               CommentEventView, CreateCommentView, CreateActionView, CreateFollowEventMemberView,
                               EventActionView, RemoveEventMemberView, AddEventMemberView, CreateUnfollowEventMemberView,
                               FollowEventView, UnfollowEventView, ImportContacts, FriendsView, GetUserProfileView,
                               UserImageView, LogoutView, UnfollowFriends, FollowFriends, ContactsView,
-                              CreateEventReactionView, CreateEventWishListView)
+                              CreateEventReactionView, CreateEventWishListView, NearbyEventsView,
+                              ObtainExpiringAuthToken, JobStatusView, FeedView, CommentThreadView,
+                              EventStreamView, BatchView)
 
 urlpatterns = [
-                  url(r'^get_auth_token/$', rest_framework_views.obtain_auth_token, name='get_auth_token'),
+                  url(r'^get_auth_token/$', ObtainExpiringAuthToken.as_view(), name='get_auth_token'),
                   url(r'^user/create/$', UserCreate.as_view()),
                   url(r'^profile/$', UpdateProfileUser.as_view()),
                   url(r'^event/create/$', EventCreateView.as_view()),
@@ -23,6 +24,7 @@ urlpatterns = [
                   url(r'^follow/member/$', CreateFollowEventMemberView.as_view()),
                   url(r'^unfollow/member/$', CreateUnfollowEventMemberView.as_view()),
                   url(r'^contacts/$', ImportContacts.as_view()),
+                  url(r'^job/$', JobStatusView.as_view()),
                   url(r'^friend/unfollow/$', UnfollowFriends.as_view()),
                   url(r'^friend/follow/$', FollowFriends.as_view()),
                   url(r'^remove/member/$', RemoveEventMemberView.as_view()),
@@ -31,6 +33,11 @@ urlpatterns = [
                   url(r'^comment/$', CommentEventView.as_view()),
                   url(r'^action/event/$', EventActionView.as_view()),
                   url(r'^user/event/$', UserEventView.as_view()),
+                  url(r'^events/nearby/$', NearbyEventsView.as_view()),
+                  url(r'^feed/$', FeedView.as_view()),
+                  url(r'^event/comments/$', CommentThreadView.as_view()),
+                  url(r'^event/stream/$', EventStreamView.as_view()),
+                  url(r'^batch/$', BatchView.as_view()),
                   url(r'^get/friends/$', FriendsView.as_view()),
                   url(r'^get/contacts/$', ContactsView.as_view()),
                   url(r'^get/profile/$', GetUserProfileView.as_view()),
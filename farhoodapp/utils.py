@@ -1,11 +1,22 @@
-from django.db.models import Q
+from collections import OrderedDict
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Case, CharField, F, Q, Value, When
+from rest_framework.authtoken.models import Token
 
 from farhoodapp.exception import ValidationError
-from farhoodapp.models import User
-from farhoodapp.serializers import FollowEventMemberSerializer
+from farhoodapp.models import Event, EventMember, User, bump_event_versions, bump_friends_versions
+from farhoodapp.phone import normalize_phone_number
+from farhoodapp.pubsub import publish_event_activity
 
 __author__ = 'DotTech Pvt. Ltd.'
 
+TEMPORARY_PASSWORD = '123456789'
+TEMPORARY_EMAIL_DOMAIN = '@dottech.info'
+# Keeps every batched statement below SQLite's 999 bound parameters.
+QUERY_BATCH_SIZE = 300
+
 from rest_framework import status
 from rest_framework.response import Response
 import json
@@ -60,27 +71,165 @@ def raise_validation_error(error_dict):
 
 
 def search_user(data):
-    phone_number = data.get('phone_number') or '0981726394'
-    user = User.objects.filter(Q(email=data.get('email')) | Q(phone_number=phone_number)).first()
+    query = Q(email=data.get('email'))
+    phone_key = normalize_phone_number(data.get('phone_number'))
+    if phone_key:
+        query |= Q(phone_key=phone_key)
+    user = User.objects.filter(query).first()
     if user:
         user.set_password(data.get('password'))
         user.temporary_profile = False
-        user.save()
+        user.save(update_fields=['password', 'temporary_profile'])
     return user
 
 
-def connect_members_with_event(event, users):
-    if users:
-        for member in users:
-            try:
-                phone_number = member.get('phone_number')
-                user = User.objects.filter(phone_number=phone_number).first()
-                request_data = {
-                    "user": user.id,
-                    "event": event.id,
-                }
-                serializer = FollowEventMemberSerializer(data=request_data)
-                if serializer.is_valid():
-                    serializer.save()
-            except:
-                pass
+def invite_event_members(event, users, follow=True):
+    """
+    Add the users matching ``users`` to ``event`` with one lookup and one insert per batch.
+
+    :param event: event the members join
+    :param users: list of dicts with a ``phone_number``
+    :param follow: initial follow flag of the new members
+    :return: one ``{'phone_number', 'user', 'status'}`` outcome per invitee, in order
+    """
+    phone_keys = [normalize_phone_number(member.get('phone_number')) if isinstance(member, dict) else None
+                  for member in users]
+
+    with transaction.atomic():
+        by_phone = {}
+        for batch in chunked(set(phone_key for phone_key in phone_keys if phone_key), QUERY_BATCH_SIZE):
+            matches = User.objects.filter(phone_key__in=batch).order_by('id')
+            for user_id, phone_key in matches.values_list('id', 'phone_key'):
+                by_phone.setdefault(phone_key, user_id)
+
+        existing = set()
+        for batch in chunked(set(by_phone.values()), QUERY_BATCH_SIZE):
+            existing.update(EventMember.objects.filter(event_id=event.id, user_id__in=batch)
+                            .values_list('user_id', flat=True))
+
+        outcomes, members = [], []
+        for member, phone_key in zip(users, phone_keys):
+            user_id = by_phone.get(phone_key)
+            if not phone_key:
+                state = 'invalid'
+            elif not user_id:
+                state = 'not_found'
+            elif user_id in existing:
+                state = 'already_member'
+            else:
+                state = 'added'
+                existing.add(user_id)
+                members.append(EventMember(event_id=event.id, user_id=user_id, follow=follow))
+            outcomes.append({'phone_number': member.get('phone_number') if isinstance(member, dict) else None,
+                             'user': user_id, 'status': state})
+
+        EventMember.objects.bulk_create(members, batch_size=QUERY_BATCH_SIZE)
+        if members:
+            # bulk_create skips post_save, so counters and stream subscribers are updated here.
+            User.objects.filter(id=event.user_id).update(participants_count=F('participants_count') + len(members))
+            bump_event_versions(Event.objects.filter(id=event.id))
+            bump_friends_versions(User.objects.filter(ref_user=event.user_id))
+            added = [member.user_id for member in members]
+            for batch in chunked(added, QUERY_BATCH_SIZE):
+                for member in EventMember.objects.filter(event_id=event.id, user_id__in=batch).values(
+                        'id', 'follow', 'user', 'event'):
+                    publish_event_activity(event.id, 'member', 'created', member)
+
+    if members:
+        from farhoodapp.services import invalidate_event  # services imports this module
+        invalidate_event(event.id, event.user_id)
+
+    return outcomes
+
+
+def chunked(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def import_contacts(user, contacts):
+    """
+    Link an address book to ``user`` with a fixed number of queries per batch.
+
+    :param user: user importing the contacts
+    :param contacts: list of dicts with ``phone_number``, ``email`` and ``name``
+    :return: number of friends linked and temporary profiles created
+    """
+    rows = OrderedDict()
+    for item in contacts:
+        phone_number = item.get('phone_number') or None
+        email = item.get('email') or None
+        if not phone_number and not email:
+            continue
+        email = User.objects.normalize_email(email or phone_number + TEMPORARY_EMAIL_DOMAIN)
+        rows.setdefault(email, (phone_number, normalize_phone_number(phone_number), item.get('name')))
+
+    with transaction.atomic():
+        by_phone, by_email = {}, {}
+        for batch in chunked(rows.items(), QUERY_BATCH_SIZE):
+            phone_keys = [phone_key for _, (_, phone_key, _) in batch if phone_key]
+            emails = [email for email, _ in batch]
+            matches = User.objects.filter(Q(phone_key__in=phone_keys) | Q(email__in=emails)).order_by('id')
+            for friend_id, phone_key, email in matches.values_list('id', 'phone_key', 'email'):
+                by_phone.setdefault(phone_key, friend_id)
+                by_email.setdefault(email, friend_id)
+
+        through = User.ref_user.through
+        friend_ids = set(through.objects.filter(from_user_id=user.id).values_list('to_user_id', flat=True))
+        follower_ids = set(through.objects.filter(to_user_id=user.id).values_list('from_user_id', flat=True))
+
+        names, linked, new_users, new_phone_keys = {}, [], [], set()
+        password = make_password(TEMPORARY_PASSWORD)
+        for email, (phone_number, phone_key, name) in rows.items():
+            friend_id = by_phone.get(phone_key) if phone_key else None
+            friend_id = friend_id or by_email.get(email)
+            if not friend_id:
+                if phone_key in new_phone_keys:
+                    continue
+                if phone_key:
+                    new_phone_keys.add(phone_key)
+                new_users.append(User(email=email, password=password, phone_number=phone_number, phone_key=phone_key,
+                                      first_name=name, temporary_profile=True))
+            elif friend_id != user.id and friend_id not in friend_ids and friend_id not in names:
+                names[friend_id] = name
+                linked.append(friend_id)
+
+        User.objects.bulk_create(new_users)
+        new_ids = []
+        for batch in chunked([new_user.email for new_user in new_users], QUERY_BATCH_SIZE):
+            new_ids.extend(User.objects.filter(email__in=batch).values_list('id', flat=True))
+        Token.objects.bulk_create([Token(key=Token().generate_key(), user_id=new_id) for new_id in new_ids])
+
+        # ref_user is symmetrical, so both directions are written like ``add`` would.
+        links, followers = [], []
+        for friend_id in linked + new_ids:
+            links.append(through(from_user_id=user.id, to_user_id=friend_id))
+            if friend_id not in follower_ids:
+                links.append(through(from_user_id=friend_id, to_user_id=user.id))
+                followers.append(friend_id)
+        through.objects.bulk_create(links)
+        # bulk_create skips m2m_changed, so friends_count is bumped here.
+        User.objects.filter(id=user.id).update(friends_count=F('friends_count') + len(linked) + len(new_ids))
+        for batch in chunked(followers, QUERY_BATCH_SIZE):
+            User.objects.filter(id__in=batch).update(friends_count=F('friends_count') + 1)
+
+        for batch in chunked(names.items(), QUERY_BATCH_SIZE):
+            whens = [When(id=friend_id, then=Value(name)) for friend_id, name in batch]
+            User.objects.filter(id__in=[friend_id for friend_id, _ in batch]).update(
+                first_name=Case(*whens, output_field=CharField()))
+        # The friend lists that changed: both sides of every new link, and the followers
+        # of renamed friends, who now see the new name.
+        for batch in chunked([user.id] + linked + new_ids, QUERY_BATCH_SIZE):
+            bump_friends_versions(User.objects.filter(id__in=batch))
+        for batch in chunked(list(names), QUERY_BATCH_SIZE):
+            bump_friends_versions(User.objects.filter(id__in=through.objects.filter(
+                to_user_id__in=batch).values('from_user_id')))
+
+    from farhoodapp.feed import link_feeds  # feed and services import this module
+    from farhoodapp.services import invalidate_friendships
+    invalidate_friendships([user.id] + linked + new_ids)
+    # Temporary profiles have no events yet, only existing users have feeds to exchange.
+    link_feeds(user.id, linked)
+
+    return {'linked': len(linked) + len(new_ids), 'created': len(new_ids)}
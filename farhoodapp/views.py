@@ -1,19 +1,47 @@
+from django.conf import settings
 from django.core.serializers import json
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition
 from rest_framework import status, generics
+from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
-from farhoodapp.utils import CustomResponse, search_user, connect_members_with_event
+from farhoodapp.authentication import token_expired
+from farhoodapp.batch import run_batch, validate_batch
+from farhoodapp.feed import pushes
+from farhoodapp.jobs import enqueue
+from farhoodapp.utils import CustomResponse, search_user, invite_event_members, import_contacts
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
-from farhoodapp.models import (User, Event, EventMember, EventReaction)
+from farhoodapp.models import (User, Event, EventMember, EventReaction, Job)
+from farhoodapp.pagination import KeysetPagination, ThreadPagination
+from farhoodapp.pubsub import event_channel, get_broker, parse_message_id, sse_stream
+from farhoodapp.upsert import insert_ignore, upsert
 from farhoodapp.services import (get_user_event, get_event_comments, get_event_actions, get_follow_events,
                                  get_unfollow_events, remove_event_member, get_friends_list, get_user_profile,
-                                 get_user_image_url, get_contacts_list)
+                                 get_user_image_url, get_contacts_list, get_nearby_events, get_friends_feed,
+                                 get_comment_thread, FEED_ORDERINGS, profile_etag, friends_etag, user_event_etag)
 from farhoodapp.serializers import (UserSerializer, EventSerializer, CommentSerializer, ActionSerializer,
                                     AddEventMemberSerializer, UnfollowEventMemberSerializer,
-                                    FollowEventMemberSerializer, TemporaryUserSerializer, ProfileSerializer,
+                                    FollowEventMemberSerializer, ProfileSerializer,
                                     UserResponseSerializer, ProfileUpdateSerializer, EventReactionSerializer,
-                                    EventWishListSerializer)
+                                    EventWishListSerializer, JobSerializer, FieldSelection)
+
+
+class ObtainExpiringAuthToken(ObtainAuthToken):
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.get_or_create(user=user)
+        if not created and token_expired(token.created):
+            token.delete()
+            token = Token.objects.create(user=user)
+        return Response({'token': token.key})
 
 
 class UserCreate(APIView):
@@ -34,7 +62,7 @@ class UserCreate(APIView):
             if serializer.is_valid():
                 user = serializer.save()
                 user.temporary_profile = False
-                user.save()
+                user.save(update_fields=['temporary_profile'])
                 return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
                                                       UserResponseSerializer(user).data)
         return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(serializer.errors))
@@ -42,14 +70,20 @@ class UserCreate(APIView):
 
 class UpdateProfileUser(APIView):
     def put(self, request, format='json'):
-        user_data = request.user
+        # request.user may be a token cache snapshot up to a minute old; edit the current row,
+        # and write only the edited columns, so other processes' changes are kept.
+        user_data = User.objects.get(id=request.user.id)
         request_data = request.data.copy()
         request_data['is_active'] = True
         serializer = ProfileUpdateSerializer(user_data, data=request_data, context={'request': request})
         if serializer.is_valid():
-            user = serializer.save()
-            user.temporary_profile = False
-            user.save()
+            new_image = 'image' in request.FILES
+            extra = {'temporary_profile': False}
+            if new_image:
+                extra['thumbnails_ready'] = False
+            user = serializer.save(**extra)
+            if new_image:
+                enqueue('process_profile_image', user=user, user_id=user.id)
             return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
                                                   ProfileUpdateSerializer(user, context={'request': request}).data)
         return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(serializer.errors))
@@ -64,9 +98,10 @@ class LogoutView(APIView):
 
 
 class GetUserProfileView(APIView):
+    @method_decorator(condition(etag_func=profile_etag))
     def get(self, request):
         id = request.user.id
-        resp = get_user_profile(id=id, request=request)
+        resp = get_user_profile(id=id, request=request, stamp=request.etag_stamp)
         return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
 
 
@@ -81,13 +116,23 @@ class EventCreateView(generics.GenericAPIView):
     serializer_class = EventSerializer
 
     def post(self, request, format='json'):
+        users = request.data.get('users')
+        if users and not (isinstance(users, list) and all(isinstance(user, dict) for user in users)):
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "users must be a list of objects")
         request_data = request.data.copy()
         request_data['user'] = request.user.id
         serializer = self.get_serializer(data=request_data)
         if serializer.is_valid():
             event = serializer.save()
-            connect_members_with_event(event, request.data.get('users'))
-            return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", EventSerializer(event).data)
+            if pushes(request.user):
+                enqueue('fanout_event', user=request.user, event_id=event.id)
+            data = EventSerializer(event).data
+            if users and len(users) > settings.JOB_QUEUE['ASYNC_THRESHOLD']:
+                data['invitation_job'] = enqueue('invite_event_members', user=request.user, event_id=event.id,
+                                                 users=users).id
+            elif users:
+                data['invitations'] = invite_event_members(event, users)
+            return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", data)
         return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(serializer.errors))
 
 
@@ -100,6 +145,8 @@ class EventEditView(APIView):
         serializer = EventSerializer(event_data, data=request_data)
         if serializer.is_valid():
             event = serializer.save()
+            if pushes(request.user):
+                enqueue('fanout_event', user=request.user, event_id=event.id)
             return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", EventSerializer(event).data)
         return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(serializer.errors))
 
@@ -137,22 +184,17 @@ class CreateEventWishListView(APIView):
 class CreateEventReactionView(APIView):
 
     def post(self, request):
-        request_data = request.data.copy()
-        request_data['user'] = request.user.id
-        user_id = request.user.id
-        event_id = int(request.data.get('event'))
-        event_reaction = EventReaction.objects.filter(event_id=event_id, user_id=user_id).first()
-
-        if event_id:
-            if event_reaction:
-                serializer = EventReactionSerializer(data=request_data, instance=event_reaction)
-            else:
-                serializer = EventReactionSerializer(data=request_data)
-            if serializer.is_valid():
-                reaction = serializer.save()
-                return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
-                                                      EventReactionSerializer(reaction).data)
-            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(serializer.errors))
+        try:
+            event_id = int(request.data.get('event'))
+            reaction = EventReactionSerializer().fields['reaction'].run_validation(request.data.get('reaction'))
+        except (TypeError, ValueError, ValidationError) as e:
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(e))
+        event_reaction, created = upsert(EventReaction, {'event_id': event_id, 'user_id': request.user.id},
+                                         {'reaction': reaction}, guard=Event.objects.filter(id=event_id))
+        if not event_reaction:
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "Event not found")
+        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
+                                              EventReactionSerializer(event_reaction).data)
 
 
 class CreateActionView(APIView):
@@ -171,50 +213,60 @@ class CreateActionView(APIView):
 
 class CreateFollowEventMemberView(APIView):
     def post(self, request, format='json'):
-        request_data = request.data.copy()
-        request_data['user'] = request.user.id
         event_id = int(request.POST.get('event'))
         if event_id:
-            serializer = FollowEventMemberSerializer(data=request_data)
-            if serializer.is_valid():
-                member = serializer.save()
+            member, created = upsert(EventMember, {'event_id': event_id, 'user_id': request.user.id},
+                                     {'follow': True}, guard=Event.objects.filter(id=event_id))
+            if member:
                 return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
                                                       FollowEventMemberSerializer(member).data)
-            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(serializer.errors))
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "Event not found")
 
 
 class CreateUnfollowEventMemberView(APIView):
     def post(self, request, format='json'):
-        request_data = request.data.copy()
-        request_data['user'] = request.user.id
         event_id = int(request.POST.get('event'))
         if event_id:
-            check_member = EventMember.objects.filter(event_id=event_id, user=request.user).first()
-            if not check_member:
-                serializer = UnfollowEventMemberSerializer(data=request_data)
-                if serializer.is_valid():
-                    member = serializer.save()
-                    return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
-                                                          UnfollowEventMemberSerializer(member).data)
-            else:
-                return Response({'error': 'Member Already Exists'}, status=status.HTTP_400_BAD_REQUEST)
+            member = insert_ignore(EventMember, {'event_id': event_id, 'user_id': request.user.id, 'follow': False},
+                                   ('event', 'user'), guard=Event.objects.filter(id=event_id))
+            if member:
+                return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
+                                                      UnfollowEventMemberSerializer(member).data)
+            if not Event.objects.filter(id=event_id).exists():
+                return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "Event not found")
+            return Response({'error': 'Member Already Exists'}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class AddEventMemberView(APIView):
     def post(self, request, format='json'):
-        request_data = request.data.copy()
-        request_data['user'] = request.user.id
+        users = request.data.get('users')
+        if users:
+            try:
+                event_id = int(request.data.get('event'))
+            except (TypeError, ValueError):
+                return CustomResponse.create_error_response(status.HTTP_404_NOT_FOUND, "Event not found")
+            event = Event.objects.filter(id=event_id, user=request.user).first()
+            if not event:
+                return CustomResponse.create_error_response(status.HTTP_404_NOT_FOUND, "Event not found")
+            if not isinstance(users, list):
+                return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "users must be a list")
+            resp = invite_event_members(event, users)
+            return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
         event_id = int(request.POST.get('event'))
         if event_id:
-            member = EventMember.objects.filter(event_id=event_id, user=request.user).first()
-            if not member:
-                serializer = AddEventMemberSerializer(data=request_data)
-                if serializer.is_valid():
-                    add_member = serializer.save()
-                    return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
-                                                          AddEventMemberSerializer(add_member).data)
-            else:
-                return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "")  # str(serializer.errors))
+            try:
+                follow = AddEventMemberSerializer().fields['follow'].run_validation(request.data.get('follow', False))
+            except ValidationError as e:
+                return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, str(e))
+            add_member = insert_ignore(EventMember,
+                                       {'event_id': event_id, 'user_id': request.user.id, 'follow': follow},
+                                       ('event', 'user'), guard=Event.objects.filter(id=event_id))
+            if add_member:
+                return CustomResponse.create_response(True, status.HTTP_200_OK, "Success",
+                                                      AddEventMemberSerializer(add_member).data)
+            if not Event.objects.filter(id=event_id).exists():
+                return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "Event not found")
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "Member Already Exists")
 
 
 class RemoveEventMemberView(APIView):
@@ -227,9 +279,11 @@ class RemoveEventMemberView(APIView):
 
 
 class UserEventView(APIView):
+    @method_decorator(condition(etag_func=user_event_etag))
     def get(self, request):
         user_id = request.user.id
-        resp = get_user_event(user_id=user_id)
+        resp = get_user_event(user_id=user_id, selection=FieldSelection.from_request(request),
+                              stamp=request.etag_stamp)
         return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
 
 
@@ -237,8 +291,48 @@ class CommentEventView(APIView):
     def get(self, request):
         user_id = request.user.id
         event_id = request.GET.get('event_id', 1)
-        resp = get_event_comments(event_id=event_id, user_id=user_id)
-        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
+        paginator = KeysetPagination(request)
+        resp = get_event_comments(event_id=event_id, user_id=user_id, paginator=paginator)
+        return paginator.get_paginated_response(resp)
+
+
+class CommentThreadView(APIView):
+    def get(self, request):
+        try:
+            event_id = int(request.GET['event_id'])
+        except (KeyError, ValueError):
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "event_id is invalid")
+        paginator = ThreadPagination(request)
+        resp = get_comment_thread(event_id=event_id, paginator=paginator)
+        return paginator.get_paginated_response(resp)
+
+
+class EventStreamView(APIView):
+    """
+    New comments, reactions and members of an event as server-sent events, or as one
+    long-poll JSON response with ``?poll=1`` for clients without EventSource.
+    """
+
+    def get(self, request):
+        try:
+            event_id = int(request.GET['event_id'])
+        except (KeyError, ValueError):
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "event_id is invalid")
+        if not Event.objects.filter(id=event_id).exists():
+            return CustomResponse.create_error_response(status.HTTP_404_NOT_FOUND, "Event not found")
+        channel = event_channel(event_id)
+        after = parse_message_id(request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id'))
+        if request.GET.get('poll'):
+            broker = get_broker()
+            after = broker.last_id(channel) if after is None else after
+            messages = broker.read(channel, after, settings.PUBSUB['KEEPALIVE'])
+            last_event_id = messages[-1][0] if messages else after
+            return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", {
+                'last_event_id': last_event_id, 'messages': [message for _, message in messages]})
+        response = StreamingHttpResponse(sse_stream(channel, after), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
 
 
 class EventActionView(APIView):
@@ -253,16 +347,54 @@ class FollowEventView(APIView):
     def get(self, request):
         user_id = request.user.id
         follow = request.GET.get('follow', True)
-        resp = get_follow_events(follow=follow, user_id=user_id)
-        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
+        paginator = KeysetPagination(request)
+        resp = get_follow_events(follow=follow, user_id=user_id, paginator=paginator)
+        return paginator.get_paginated_response(resp)
 
 
 class UnfollowEventView(APIView):
     def get(self, request):
         user_id = request.user.id
         follow = request.GET.get('follow', False)
-        resp = get_unfollow_events(follow=follow, user_id=user_id)
-        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
+        paginator = KeysetPagination(request)
+        resp = get_unfollow_events(follow=follow, user_id=user_id, paginator=paginator)
+        return paginator.get_paginated_response(resp)
+
+
+class NearbyEventsView(APIView):
+    def get(self, request):
+        try:
+            latitude = float(request.GET['latitude'])
+            longitude = float(request.GET['longitude'])
+            radius = float(request.GET.get('radius', 5))
+            start, end = [parse_datetime(request.GET[name]) if request.GET.get(name) else False
+                          for name in ('start', 'end')]
+            if start is None or end is None:
+                raise ValueError
+        except (KeyError, ValueError):
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST,
+                                                        "latitude, longitude, radius, start or end is invalid")
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180
+                and 0 < radius <= settings.NEARBY_EVENTS_MAX_RADIUS):
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST,
+                                                        "latitude, longitude or radius is out of range")
+        paginator = KeysetPagination(request)
+        resp = get_nearby_events(latitude=latitude, longitude=longitude, radius=radius,
+                                 event_type=request.GET.get('event_type'), start=start, end=end, paginator=paginator,
+                                 selection=FieldSelection.from_request(request))
+        return paginator.get_paginated_response(resp)
+
+
+class FeedView(APIView):
+    def get(self, request):
+        order = request.GET.get('order', 'recent')
+        if order not in FEED_ORDERINGS:
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST,
+                                                        "order must be one of {}".format(', '.join(FEED_ORDERINGS)))
+        paginator = KeysetPagination(request)
+        resp = get_friends_feed(user_id=request.user.id, order=order, paginator=paginator,
+                                selection=FieldSelection.from_request(request))
+        return paginator.get_paginated_response(resp)
 
 
 class UnfollowFriends(APIView):
@@ -271,7 +403,7 @@ class UnfollowFriends(APIView):
         user_id = request.POST.get('user_id')
         friend = User.objects.filter(id=user_id).first()
         if friend in user.ref_user.all():
-            user.ref_user.filter(id=friend.id).delete()
+            user.ref_user.remove(friend)
             return CustomResponse.create_response(True, status.HTTP_200_OK, 'Success', {})
         else:
             return CustomResponse.create_response(True, status.HTTP_200_OK, 'Not friend of this User', {})
@@ -290,50 +422,62 @@ class FollowFriends(APIView):
 
 
 class FriendsView(APIView):
+    @method_decorator(condition(etag_func=friends_etag))
     def get(self, request):
         id = request.user.id
-        resp = get_friends_list(id=id)
-        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
+        paginator = KeysetPagination(request)
+        resp = get_friends_list(id=id, paginator=paginator, stamp=request.etag_stamp)
+        return paginator.get_paginated_response(resp)
 
 
 class ContactsView(APIView):
+    @method_decorator(condition(etag_func=friends_etag))
     def get(self, request):
         id = request.user.id
-        resp = get_contacts_list(id=id)
-        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
+        paginator = KeysetPagination(request)
+        resp = get_contacts_list(id=id, paginator=paginator)
+        return paginator.get_paginated_response(resp)
 
 
 class ImportContacts(APIView):
     parser_classes = (JSONParser,)
 
     def post(self, request):
-        # import pdb;pdb.set_trace()
-        dict_list = request.data
-        users = request.user.ref_user.all()
-        # friend_users = request.user.ref_user.filter(temporary_profile=False)
-        for item in dict_list:
-            phone_number = item.get('phone_number')
-            email = item.get('email')
-            name = item.get('name')
-            friend = User.objects.filter(phone_number=phone_number).first()
-            if friend and friend not in users:
-                request.user.ref_user.add(friend)
-                friend.first_name = name
-                friend.save()
-            elif not friend:
-                if email:
-                    data = {"email": email, "password": "123456789"}
-                elif not email:
-                    phone = phone_number + "@dottech.info"
-                    data = {"email": phone, "password": "123456789"}
-                serializer = TemporaryUserSerializer(data=data)
-                if serializer.is_valid():
-                    s = serializer.save()
-                    s.temporary_profile = True
-                    s.phone_number = phone_number
-                    s.first_name = name
-                    id = s.id
-                    new_friend = User.objects.filter(id=id).first()
-                    request.user.ref_user.add(new_friend)
-                    s.save()
-        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", {})
+        contacts = request.data
+        if request.GET.get('async') or len(contacts) > settings.JOB_QUEUE['ASYNC_THRESHOLD']:
+            job = enqueue('import_contacts', user=request.user, user_id=request.user.id, contacts=contacts)
+            return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", JobSerializer(job).data)
+        resp = import_contacts(request.user, contacts)
+        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)
+
+
+class JobStatusView(APIView):
+    def get(self, request):
+        try:
+            job_id = int(request.GET['job_id'])
+        except (KeyError, ValueError):
+            return CustomResponse.create_error_response(status.HTTP_404_NOT_FOUND, "Job not found")
+        job = Job.objects.filter(id=job_id, user=request.user).first()
+        if not job:
+            return CustomResponse.create_error_response(status.HTTP_404_NOT_FOUND, "Job not found")
+        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", JobSerializer(job).data)
+
+
+class BatchView(APIView):
+    """
+    Run several API calls in one round trip, e.g. the requests fired at app launch:
+    ``{"requests": [{"method": "GET", "path": "/farhood/get/profile/"}, ...], "parallel": true}``.
+    Each request may carry its own ``headers``, e.g. ``{"If-None-Match": <etag>}``.
+    """
+    parser_classes = (JSONParser,)
+
+    def post(self, request):
+        if not isinstance(request.data, dict):
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, "Body must be a JSON object")
+        items = request.data.get('requests')
+        error = validate_batch(items)
+        if error:
+            return CustomResponse.create_error_response(status.HTTP_400_BAD_REQUEST, error)
+        resp = run_batch(request, items, parallel=bool(request.data.get('parallel')),
+                         excluded=(BatchView, EventStreamView))
+        return CustomResponse.create_response(True, status.HTTP_200_OK, "Success", resp)